@@ -0,0 +1,177 @@
+"""
+Chart helpers for the pages: the line chart factory with its WebGL mode, LTTB
+downsampling of long series, and the figure cache. Figures are kept in the
+data_store bounded cache, next to the aggregates they are built from.
+"""
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import data_store as ds
+
+# Point budget of a chart trace: one point per pixel of a chart this wide.
+CHART_WIDTH = int(os.environ.get("BI_CHART_WIDTH", "1000"))
+
+def lttb_rows(x, y, points):
+    """
+    Pick the rows of a series to draw with Largest-Triangle-Three-Buckets: the first
+    and last rows, and from each of points - 2 equal buckets in between the row that
+    forms the largest triangle with the row picked before it and the mean of the next
+    bucket. Peaks and troughs survive, unlike with every n-th row.
+    :param x: Array of increasing x values as floats
+    :param y: Array of y values as floats
+    :param points: Number of rows to pick
+    :return: Array of picked row positions, in order
+    """
+    if points >= len(x) or points < 3:
+        return np.arange(len(x))
+    edges = np.linspace(1, len(x) - 1, points - 1).astype(np.int64)
+    rows = np.empty(points, dtype=np.int64)
+    rows[0], rows[-1] = 0, len(x) - 1
+    picked = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else len(x)
+        mean_x, mean_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[picked] - mean_x) * (y[start:end] - y[picked]) - (x[picked] - x[start:end]) * (mean_y - y[picked]))
+        picked = start + int(np.argmax(areas))
+        rows[bucket + 1] = picked
+    return rows
+
+@ds.bounded_cache(ttl=600, key=lambda df, x, y, points=CHART_WIDTH, window=None: (x, y, points, window),
+               frame=lambda df, x, y, points=CHART_WIDTH, window=None: df)
+def downsample(df, x, y, points=CHART_WIDTH, window=None):
+    """
+    Reduce a time series to the rows worth drawing, with lttb_rows. Within a window
+    narrow enough to hold no more rows than the budget, every row is kept.
+    :param df: Aggregated dataframe in time order, as get_aggregate returns
+    :param x: Name of the date or timestamp column
+    :param y: Name of the value column
+    :param points: Maximum number of rows to return
+    :param window: Optional tuple of the first and last x value to keep
+    :return: Dataframe of the x and y columns of the kept rows
+    """
+    times = pd.to_datetime(df[x]).to_numpy()
+    start, end = 0, len(df)
+    if window:
+        start = np.searchsorted(times, np.datetime64(pd.Timestamp(window[0])), side='left')
+        end = np.searchsorted(times, np.datetime64(pd.Timestamp(window[1])), side='right')
+    if start >= end:
+        return df[[x, y]].iloc[:0]
+    seconds = (times[start:end] - times[start]) / np.timedelta64(1, 's')
+    rows = lttb_rows(seconds, df[y].to_numpy(dtype=np.float64)[start:end], points)
+    return df[[x, y]].iloc[start + rows]
+
+# Charts with more points than this draw their traces with WebGL (Scattergl) rather
+# than SVG, which keeps the browser responsive on long daily series.
+WEBGL_POINTS = int(os.environ.get("BI_WEBGL_POINTS", "1000"))
+
+def frame_traces(df, x, y, color=None, name=None):
+    """
+    Split the rows of a dataframe into line traces, one per value of the color column.
+    :param df: Dataframe holding the x, y and color columns
+    :param x: Name of the x column
+    :param y: Name of the y column
+    :param color: Optional name of the column whose values each get a trace
+    :param name: Trace name when there is no color column
+    :return: List of trace dictionaries with name, x and y
+    """
+    if color is None:
+        return [{"name": name, "x": df[x].to_numpy(), "y": df[y].to_numpy()}]
+    return [{"name": str(value), "x": group[x].to_numpy(), "y": group[y].to_numpy()}
+            for value, group in df.groupby(color, observed=True, sort=True)]
+
+def line_chart(title, traces, markers=False, x_title=None, y_title=None, legend_title=None):
+    """
+    Build a line chart from traces, as Scatter traces or, above WEBGL_POINTS points in
+    total, as Scattergl traces.
+    :param title: Chart title
+    :param traces: List of trace dictionaries as returned by frame_traces
+    :param markers: Whether to mark every point
+    :param x_title: Optional x axis title
+    :param y_title: Optional y axis title
+    :param legend_title: Optional legend title
+    :return: Plotly figure
+    """
+    trace_type = go.Scattergl if sum(len(trace["x"]) for trace in traces) > WEBGL_POINTS else go.Scatter
+    mode = 'lines+markers' if markers else 'lines'
+    fig = go.Figure([trace_type(x=trace["x"], y=trace["y"], name=trace["name"], mode=mode,
+                                showlegend=trace["name"] is not None) for trace in traces])
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title=y_title, legend_title_text=legend_title)
+    return fig
+
+def frame_chart(df, x, y, title, color=None, markers=False, labels=None):
+    """
+    Build a line chart of a dataframe's y column over its x column, with one trace per
+    value of the color column, in the manner of px.line.
+    :param df: Dataframe holding the x, y and color columns
+    :param x: Name of the x column
+    :param y: Name of the y column
+    :param title: Chart title
+    :param color: Optional name of the column whose values each get a trace
+    :param markers: Whether to mark every point
+    :param labels: Optional dictionary of display names for the columns
+    :return: Plotly figure
+    """
+    labels = labels or {}
+    return line_chart(title, frame_traces(df, x, y, color), markers=markers, x_title=labels.get(x, x),
+                      y_title=labels.get(y, y), legend_title=labels.get(color, color))
+
+# Figures built and reused by cached_figure, and the build time reuse saved.
+FIGURE_COUNTERS = {"built": 0, "reused": 0, "seconds_saved": 0.0}
+FIGURE_LOCK = threading.Lock()
+
+@ds.bounded_cache(ttl=None, key=lambda df: (), frame=lambda df: df)
+def frame_fingerprint(df):
+    """
+    Return a digest of a dataframe's columns, dtypes, index and values. It is computed
+    once per frame, so fingerprinting a cached aggregate again is free.
+    """
+    digest = hashlib.blake2b(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode(), digest_size=16)
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def figure_nbytes(fig):
+    """
+    Return the approximate in-memory size of a Plotly figure's trace data in bytes.
+    """
+    return sum(ds.value_nbytes(pd.Series(trace[axis])) for trace in fig.data for axis in ["x", "y"] if trace[axis] is not None)
+
+def cached_figure(builder, *frames, **options):
+    """
+    Return builder(*frames, **options), reusing the figure built before from frames
+    with the same fingerprint and the same options instead of building it again.
+    The figure is shared between reruns, so callers must not modify it.
+    :param builder: Function building a Plotly figure, such as px.line
+    :param frames: Dataframes (or None) passed to the builder positionally
+    :param options: Keyword arguments passed to the builder; their repr is part of the key
+    :return: Plotly figure
+    """
+    code = getattr(builder, "__code__", None)
+    key = ("cached_figure", (code.co_filename if code else builder.__module__, builder.__qualname__,
+           tuple(None if df is None else frame_fingerprint(df) for df in frames), repr(sorted(options.items()))), None)
+    found, entry = ds.cache_get(key)
+    if found:
+        with FIGURE_LOCK:
+            FIGURE_COUNTERS["reused"] += 1
+            FIGURE_COUNTERS["seconds_saved"] += entry["seconds"]
+        return entry["figure"]
+    start = time.perf_counter()
+    fig = builder(*frames, **options)
+    entry = {"figure": fig, "seconds": time.perf_counter() - start}
+    ds.cache_put(key, entry, ds.CACHE_TTL_SECONDS, nbytes=figure_nbytes(fig))
+    with FIGURE_LOCK:
+        FIGURE_COUNTERS["built"] += 1
+    return fig
+
+def figure_summary():
+    """
+    Describe how many figures were reused rather than rebuilt, and the time saved.
+    """
+    with FIGURE_LOCK:
+        counters = dict(FIGURE_COUNTERS)
+    return (f"Charts built: {counters['built']:,}, reused: {counters['reused']:,} "
+            f"({counters['seconds_saved']:.2f} s of rebuilding saved)")
@@ -1,16 +1,433 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
 from snowflake.snowpark import Session
 import configparser
 import os
+import json
+import re
+import hashlib
+import tempfile
+import getpass
+import sys
+import threading
+import time
+import weakref
+import functools
+import itertools
+from collections import OrderedDict, namedtuple
 from snowflake.snowpark.context import get_active_session
 
+# Every column the book-transaction join can return, keyed by output alias.
+# The table prefix of each source expression names the join it depends on.
+COLUMNS = {
+    "FB_BOOK_TRANS_WID": "fb.BOOK_TRANS_WID",
+    "FB_BOOK_TRANS_ID": "fb.BOOK_TRANS_ID",
+    "FB_VISIT_ID": "fb.VISIT_ID",
+    "FB_CORPORATE_ENTITY_ID": "fb.CORPORATE_ENTITY_ID",
+    "FB_MANAGEMENT_ENTITY_ID": "fb.MANAGEMENT_ENTITY_ID",
+    "FB_VENUE_ID": "fb.VENUE_ID",
+    "FB_SOURCE_SYSTEMS": "fb.SOURCE_SYSTEMS",
+    "FB_SERVICE_ID": "fb.SERVICE_ID",
+    "FB_CREATESERVICETSTAMP": "fb.CREATESERVICETSTAMP",
+    "FB_MODSERVICETSTAMP": "fb.MODSERVICETSTAMP",
+    "FB_SERVICE_DATE": "fb.SERVICE_DATE",
+    "FB_TRANSTIXREF": "fb.TRANSTIXREF",
+    "FB_BILLED_NAME": "fb.BILLED_NAME",
+    "FB_CART_ID": "fb.CART_ID",
+    "FB_CHARGE_AMOUNT": "fb.CHARGE_AMOUNT",
+    "FB_CITY": "fb.CITY",
+    "FB_COUNTRY_CODE": "fb.COUNTRY_CODE",
+    "FB_EMAIL": "fb.EMAIL",
+    "FB_EVENT_ID": "fb.EVENT_ID",
+    "FB_GLOBALTYPE_DESC": "fb.GLOBALTYPE_DESC",
+    "FB_ITEM_NAME": "fb.ITEM_NAME",
+    "FB_MASTERITEM_ID": "fb.MASTERITEM_ID",
+    "FB_PARTY_ID": "fb.PARTY_ID",
+    "FB_PAYACTION_DESC": "fb.PAYACTION_DESC",
+    "FB_PAYTYPE_DESC": "fb.PAYTYPE_DESC",
+    "FB_PLANNED_GUEST_COUNT": "fb.PLANNED_GUEST_COUNT",
+    "FB_PRESALE_TRANS_ID": "fb.PRESALE_TRANS_ID",
+    "FB_PROVINCE_CODE": "fb.PROVINCE_CODE",
+    "FB_SPENDAGREE_AMOUNT": "fb.SPENDAGREE_AMOUNT",
+    "FB_SUBTOTAL_AMOUNT": "fb.SUBTOTAL_AMOUNT",
+    "FB_TIXID": "fb.TIXID",
+    "FB_TRANSTIXID": "fb.TRANSTIXID",
+    "FB_ZIP": "fb.ZIP",
+
+    "VS_VISIT_WID": "vs.VISIT_WID",
+    "VS_CURRENTSTATE_DESC": "vs.CURRENTSTATE_DESC",
+    "VS_COMPAGREE_AMOUNT": "vs.COMPAGREE_AMOUNT",
+    "VS_ORIGINATOR_ID": "vs.ORIGINATOR_ID",
+    "VS_OWNER_ID": "vs.OWNER_ID",
+    "VS_SPENDAGREE_AMOUNT": "vs.SPENDAGREE_AMOUNT",
+    "VS_SOURCE_CODE": "vs.SOURCE_CODE",
+    "VS_CANCELSTATE_DESC": "vs.CANCELSTATE_DESC",
+    "VS_SOURCE_LOC": "vs.SOURCE_LOC",
+
+    "VN_VENUE_RECORD_STATUS": "vn.VENUE_RECORD_STATUS",
+    "VN_CORPORATE_ENTITY_NAME": "vn.CORPORATE_ENTITY_NAME",
+    "VN_MANAGEMENT_ENTITY_NAME": "vn.MANAGEMENT_ENTITY_NAME",
+    "VN_VENUE_NAME": "vn.VENUE_NAME",
+    "VN_VENUE_MARKET_AREA_NAME": "vn.VENUE_MARKET_AREA_NAME",
+    "VN_VENUE_TYPE_NAME": "vn.VENUE_TYPE_NAME",
+    "VN_VENUE_CITY": "vn.VENUE_CITY",
+    "VN_VENUE_PROVINCE": "vn.VENUE_PROVINCE",
+    "VN_VENUE_COUNTRY": "vn.VENUE_COUNTRY",
+
+    "IT_ITEM_ID": "it.ITEM_ID",
+    "IT_ITEM_GLOBALTYPE_CODE": "it.ITEM_GLOBALTYPE_CODE",
+    "IT_ITEM_PREFAB": "it.ITEM_PREFAB",
+    "IT_ITEM_PRICINGS": "it.ITEM_PRICINGS",
+    "IT_ITEM_PUBLICNAME": "it.ITEM_PUBLICNAME",
+    "IT_ITEM_BOOKTYPE_NAME": "it.ITEM_BOOKTYPE_NAME",
+    "IT_ITEM_TYPE_CODE_NAME": "it.ITEM_TYPE_CODE_NAME"
+}
+
+# Source tables by alias, and the joins needed to reach each dimension table in the
+# order they must appear.
+TABLES = {
+    "fb": "edw.public.fact_book_trans",
+    "vs": "edw.public.dim_visit",
+    "vn": "edw.public.dim_venue",
+    "it": "edw.public.dim_item"
+}
+JOINS = {
+    "vs": "fb.visit_id = vs.visit_id",
+    "vn": "vs.venue_id = vn.venue_id",
+    "it": "fb.masteritem_id = it.item_id"
+}
+JOIN_DEPENDENCIES = {"vn": ["vs"]}
+
+# Columns every query returns: the row key and the dates get_dataframe converts.
+KEY_COLUMNS = ["FB_BOOK_TRANS_WID"]
+DATE_COLUMNS = ["FB_CREATESERVICETSTAMP", "FB_SERVICE_DATE"]
+
+# Sidebar filter keys and the columns they apply to.
+FILTER_COLUMNS = {
+    "corporate_entity": "VN_CORPORATE_ENTITY_NAME",
+    "management_entity": "VN_MANAGEMENT_ENTITY_NAME",
+    "venue": "VN_VENUE_NAME",
+    "venue_type": "VN_VENUE_TYPE_NAME",
+    "global_type": "FB_GLOBALTYPE_DESC",
+    "pay_type": "FB_PAYTYPE_DESC",
+    "pay_status": "FB_PAYACTION_DESC"
+}
+DIMENSION_COLUMNS = list(FILTER_COLUMNS.values())
+METRIC_COLUMNS = ["FB_CHARGE_AMOUNT", "FB_SPENDAGREE_AMOUNT", "FB_SUBTOTAL_AMOUNT", "FB_PLANNED_GUEST_COUNT"]
+
+# Storage schema for loaded data: low-cardinality text is held as category and integer
+# columns are downcast to the smallest type that holds their values. Amounts stay
+# float64 so sums over them keep their precision.
+COMPACT_DTYPES = True
+CATEGORY_COLUMNS = [col for col in COLUMNS
+                    if col.startswith(("VN_", "IT_")) and col != "IT_ITEM_ID" or col.endswith("_DESC")]
+CATEGORY_COLUMNS += ["FB_SOURCE_SYSTEMS", "FB_COUNTRY_CODE", "FB_PROVINCE_CODE", "VS_SOURCE_CODE"]
+INTEGER_COLUMNS = [col for col in COLUMNS if col.endswith(("_ID", "_WID", "_COUNT")) and col not in CATEGORY_COLUMNS]
+
+# Rows get_dataframe keeps after date conversion, expressed on the source columns.
+VALID_ROW_PREDICATES = [
+    "fb.CREATESERVICETSTAMP IS NOT NULL",
+    "TRY_TO_DATE(fb.SERVICE_DATE, 'MM/DD/YYYY') IS NOT NULL"
+]
+
+# Where queries run: "snowflake", or "local" for an in-process DuckDB database filled
+# with BI_LOCAL_ROWS synthetic transactions (see local_backend.py).
+BACKEND = os.environ.get("BI_BACKEND", "snowflake")
+LOCAL_ROWS = int(os.environ.get("BI_LOCAL_ROWS", "100000"))
+LOCAL_DATABASE = os.environ.get("BI_LOCAL_DATABASE", ":memory:")
+
+# Convert the date columns in the query, from epoch seconds and MM/DD/YYYY strings to
+# timestamps, and drop rows with invalid dates there. When off, prepare_batch converts
+# them in pandas, parsing each distinct service date string only once; the local
+# backend does that, as it is faster in process than parsing every row in DuckDB.
+SQL_DATE_CONVERSION = BACKEND != "local"
+CONVERTED_COLUMNS = {
+    "FB_CREATESERVICETSTAMP": "TO_TIMESTAMP_NTZ(fb.CREATESERVICETSTAMP)",
+    "FB_SERVICE_DATE": "CAST(TRY_TO_DATE(fb.SERVICE_DATE, 'MM/DD/YYYY') AS TIMESTAMP)"
+}
+
+# Load filtered data by pushing the filters into the Snowflake query rather than
+# loading the whole join and filtering it in pandas. get_dataset only pushes filters
+# down for a dataset not yet loaded in this process; once loaded, it is sliced instead.
+FILTER_PUSHDOWN = True
+
+# Keep one row per KEY_COLUMNS value in the query itself, so duplicates from the fact
+# table or from the dim_visit/dim_venue join fan-out never reach the app. The row kept
+# is the latest modification, then the latest visit record. When off, load_batches
+# removes repeated keys by hash instead.
+DEDUP_IN_QUERY = True
+DEDUP_ORDER = [
+    ("fb", "fb.MODSERVICETSTAMP DESC NULLS LAST"),
+    ("vs", "vs.VISIT_WID DESC NULLS LAST")
+]
+
+def canonical_filters(filters):
+    """
+    Reduce a filter dictionary to a hashable, order-independent form.
+    Empty selections are dropped and multiselect values are sorted, so the same
+    selection made in a different order maps to the same cache key.
+    :param filters: A dictionary of filters as returned by get_filters
+    :return: Tuple of (filter key, value) pairs
+    """
+    canonical = []
+    if filters.get("date_range"):
+        start_date, end_date = filters["date_range"]
+        canonical.append(("date_range", (filters["date_column"], pd.Timestamp(start_date), pd.Timestamp(end_date))))
+    for key in FILTER_COLUMNS:
+        if filters.get(key):
+            canonical.append((key, tuple(sorted(set(filters[key])))))
+    return tuple(canonical)
+
+def build_predicates(filters):
+    """
+    Translate a filter dictionary into bound-parameter SQL predicates on the source columns.
+    :param filters: A dictionary of filters as returned by get_filters
+    :return: Tuple of (list of SQL predicates, list of bind parameters)
+    """
+    predicates = []
+    params = []
+    for key, value in canonical_filters(filters):
+        if key == "date_range":
+            date_col, start_date, end_date = value
+            if date_col == "FB_CREATESERVICETSTAMP":
+                # Stored as epoch seconds; compare on the raw column so partitions prune
+                predicates.append(f"{COLUMNS[date_col]} BETWEEN ? AND ?")
+                params.extend([int(start_date.timestamp()), int(end_date.timestamp())])
+            else:
+                predicates.append(f"TRY_TO_DATE({COLUMNS[date_col]}, 'MM/DD/YYYY') BETWEEN ? AND ?")
+                params.extend([start_date.date(), end_date.date()])
+        else:
+            placeholders = ", ".join("?" for _ in value)
+            predicates.append(f"{COLUMNS[FILTER_COLUMNS[key]]} IN ({placeholders})")
+            params.extend(value)
+    return predicates, params
+
+def selected_columns(columns, metrics=()):
+    """
+    Return the columns a query selects: the key and date columns followed by the
+    requested columns and metrics, without repeats.
+    :param columns: List of column aliases from COLUMNS
+    :param metrics: List of metric column aliases from COLUMNS
+    """
+    selected = list(dict.fromkeys(KEY_COLUMNS + DATE_COLUMNS + list(columns) + list(metrics)))
+    unknown = [col for col in selected if col not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns requested: {', '.join(unknown)}")
+    return selected
+
+def query_tables(selected, predicates=()):
+    """
+    Return the aliases of the tables a query over the selected columns must read,
+    including the tables its predicates refer to.
+    :param selected: List of column aliases from COLUMNS
+    :param predicates: SQL predicates on the source columns
+    """
+    aliases = [COLUMNS[col].split(".")[0] for col in selected]
+    for predicate in predicates:
+        aliases += [alias for alias in re.findall(r"\b(\w+)\.", predicate) if alias in TABLES]
+    tables = {"fb"}
+    for alias in aliases:
+        tables.add(alias)
+        tables.update(JOIN_DEPENDENCIES.get(alias, []))
+    return tables
+
+def build_query(columns, metrics=(), predicates=()):
+    """
+    Build the book-transaction query, selecting only the columns a page needs.
+    Key and date columns are always included, and joins whose tables supply
+    no selected column are left out. With DEDUP_IN_QUERY the query returns one
+    row per key (see DEDUP_ORDER), and with SQL_DATE_CONVERSION the date columns
+    come back as timestamps with invalid rows already dropped. Predicates are
+    applied to the source columns.
+    :param columns: List of column aliases from COLUMNS
+    :param metrics: List of metric column aliases from COLUMNS
+    :param predicates: Extra SQL predicates to AND into the WHERE clause
+    :return: SQL query string
+    """
+    selected = selected_columns(columns, metrics)
+    tables = query_tables(selected, predicates)
+    expressions = dict(COLUMNS, **CONVERTED_COLUMNS) if SQL_DATE_CONVERSION else COLUMNS
+    select_list = ",\n    ".join(f"{expressions[col]} as {col}" for col in selected)
+    if SQL_DATE_CONVERSION:
+        predicates = list(dict.fromkeys(VALID_ROW_PREDICATES + list(predicates)))
+    joins = "".join(f"\n    LEFT JOIN {TABLES[alias]} {alias} on {condition}"
+                    for alias, condition in JOINS.items() if alias in tables)
+    where = "".join(f"\n    AND {predicate}" for predicate in predicates)
+    qualify = ""
+    if DEDUP_IN_QUERY:
+        partition = ", ".join(COLUMNS[col] for col in KEY_COLUMNS)
+        order = ", ".join(expression for alias, expression in DEDUP_ORDER if alias in tables)
+        qualify = f"\n    QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {order}) = 1"
+    return f"""
+    SELECT
+    {select_list}
+    FROM {TABLES['fb']} fb{joins}
+    WHERE fb.source_systems IN ('PAY', 'urcheckout'){where}{qualify}
+"""
+
+# Byte budget shared by every bounded_cache entry in this process, and the default
+# lifetime of an entry in seconds. Values larger than the whole budget are not cached
+# and are counted as "oversize" in CACHE_COUNTERS.
+CACHE_MAX_BYTES = int(os.environ.get("BI_CACHE_MAX_BYTES", str(1024 ** 3)))
+CACHE_TTL_SECONDS = 3600
+
+# Cache entries in least-recently-used order: key -> (value, bytes, expiry time, frame token).
+CACHE_ENTRIES = OrderedDict()
+CACHE_COUNTERS = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "oversize": 0, "bytes": 0}
+CACHE_LOCK = threading.RLock()
+FRAME_TOKENS = set()
+
+def value_nbytes(value):
+    """
+    Return the approximate in-memory size of a cached value in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_nbytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+def cache_discard(key):
+    """
+    Remove one entry from the bounded cache. The caller must hold CACHE_LOCK.
+    """
+    _, nbytes, _, _ = CACHE_ENTRIES.pop(key)
+    CACHE_COUNTERS["bytes"] -= nbytes
+
+def cache_get(key):
+    """
+    Look up a bounded cache entry, dropping it if it has expired.
+    :return: Tuple of (found, value)
+    """
+    with CACHE_LOCK:
+        entry = CACHE_ENTRIES.get(key)
+        if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+            cache_discard(key)
+            CACHE_COUNTERS["expirations"] += 1
+            entry = None
+        if entry is None:
+            CACHE_COUNTERS["misses"] += 1
+            return False, None
+        CACHE_ENTRIES.move_to_end(key)
+        CACHE_COUNTERS["hits"] += 1
+        return True, entry[0]
+
+def cache_put(key, value, ttl=None, token=None, nbytes=None):
+    """
+    Store a value in the bounded cache, evicting least-recently-used entries until the
+    cache fits in CACHE_MAX_BYTES. Values larger than the whole budget are only counted.
+    :param key: Hashable cache key
+    :param value: Value to cache
+    :param ttl: Lifetime in seconds, or None for no expiry
+    :param token: Frame token (see frame_token) whose collection invalidates the entry
+    :param nbytes: Size of the value in bytes, for values value_nbytes cannot measure
+    """
+    if nbytes is None:
+        nbytes = value_nbytes(value)
+    if nbytes > CACHE_MAX_BYTES:
+        with CACHE_LOCK:
+            CACHE_COUNTERS["oversize"] += 1
+        return
+    with CACHE_LOCK:
+        if key in CACHE_ENTRIES:
+            cache_discard(key)
+        CACHE_ENTRIES[key] = (value, nbytes, None if ttl is None else time.monotonic() + ttl, token)
+        CACHE_COUNTERS["bytes"] += nbytes
+        while CACHE_COUNTERS["bytes"] > CACHE_MAX_BYTES:
+            cache_discard(next(iter(CACHE_ENTRIES)))
+            CACHE_COUNTERS["evictions"] += 1
+
+def frame_token(df):
+    """
+    Return a cache-key token identifying a live DataFrame without hashing its contents.
+    Entries keyed on the token are dropped when the DataFrame is garbage collected,
+    so the token is never reused for a different frame while still cached.
+    Cached results keyed on a frame assume the frame is not modified in place.
+    """
+    token = ("frame", id(df))
+    with CACHE_LOCK:
+        if token not in FRAME_TOKENS:
+            FRAME_TOKENS.add(token)
+            weakref.finalize(df, discard_frame_token, token)
+    return token
+
+def discard_frame_token(token):
+    """
+    Drop every cache entry bound to a frame token once its DataFrame is collected.
+    """
+    with CACHE_LOCK:
+        FRAME_TOKENS.discard(token)
+        for key in [key for key, entry in CACHE_ENTRIES.items() if entry[3] == token]:
+            cache_discard(key)
+
+def bounded_cache(ttl=CACHE_TTL_SECONDS, key=None, frame=None):
+    """
+    Decorator caching a function's results in the process-wide bounded LRU cache.
+    Unlike st.cache_data, hits return the cached object itself rather than a copy,
+    so callers must not modify returned DataFrames in place.
+    :param ttl: Lifetime of each entry in seconds, or None for no expiry
+    :param key: Function building a hashable key from the call arguments;
+                defaults to the arguments themselves
+    :param frame: Function returning the input DataFrame from the call arguments;
+                  entries are then keyed on that frame's identity (see frame_token).
+                  When it returns None the entry is keyed on the arguments alone
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            frame_value = frame(*args, **kwargs) if frame else None
+            token = None if frame_value is None else frame_token(frame_value)
+            call_key = (func.__qualname__, call_key, token)
+            found, value = cache_get(call_key)
+            if not found:
+                value = func(*args, **kwargs)
+                cache_put(call_key, value, ttl, token)
+            return value
+
+        def clear():
+            with CACHE_LOCK:
+                for cached_key in [k for k in CACHE_ENTRIES if k[0] == func.__qualname__]:
+                    cache_discard(cached_key)
+
+        wrapper.clear = clear
+        return wrapper
+    return decorator
+
+def clear_bounded_cache():
+    """
+    Drop every bounded cache entry. The hit, miss and eviction counters are kept.
+    """
+    with CACHE_LOCK:
+        CACHE_ENTRIES.clear()
+        CACHE_COUNTERS["bytes"] = 0
+
+def cache_stats():
+    """
+    Return the bounded cache counters with the current entry count and byte budget.
+    """
+    with CACHE_LOCK:
+        return dict(CACHE_COUNTERS, entries=len(CACHE_ENTRIES), max_bytes=CACHE_MAX_BYTES)
+
 @st.cache_resource
 def get_session():
     """
     Establishes and returns a Snowflake session using credentials from the SnowSQL config file.
+    With the local backend, returns a DuckDB-backed session over synthetic data instead.
     Caches the session to avoid reloading on every execution.
     """
+    if BACKEND == "local":
+        import local_backend
+        return local_backend.create_local_session(LOCAL_ROWS, database=LOCAL_DATABASE)
     try:
         return get_active_session()
     except:
@@ -27,70 +444,996 @@ def get_session():
         }
         return Session.builder.configs(pars).create()
 
-@st.cache_data(show_spinner=False)
-def get_dataframe(query):
+# Service date strings already parsed in this process, and their timestamps.
+SERVICE_DATES = pd.Series(dtype="datetime64[ns]")
+SERVICE_DATES_LOCK = threading.Lock()
+
+def parse_service_dates(values):
+    """
+    Parse MM/DD/YYYY service date strings by parsing each distinct string once and
+    mapping the results back to the rows. Parsed strings are kept in SERVICE_DATES,
+    so later batches and loads only parse strings not seen before.
+    :param values: Series of service date strings
+    :return: Array of datetime64[ns], NaT where a string is missing or malformed
+    """
+    global SERVICE_DATES
+    codes, uniques = pd.factorize(values)
+    with SERVICE_DATES_LOCK:
+        new = pd.Index(uniques).difference(SERVICE_DATES.index)
+        if len(new):
+            parsed = pd.Series(pd.to_datetime(new, format='%m/%d/%Y', errors='coerce'), index=new)
+            SERVICE_DATES = pd.concat([SERVICE_DATES, parsed])
+        parsed = SERVICE_DATES.reindex(uniques).to_numpy()
+    dates = parsed.take(codes)
+    dates[codes < 0] = np.datetime64("NaT")
+    return dates
+
+def prepare_batch(batch):
+    """
+    Convert the date columns of a result batch to datetime64[ns] and drop rows with
+    missing or erroneous dates. With SQL_DATE_CONVERSION the query has already
+    converted and filtered them.
+    :param batch: Raw pandas batch of query results
+    :return: The converted batch
+    """
+    if not SQL_DATE_CONVERSION:
+        batch['FB_CREATESERVICETSTAMP'] = pd.to_datetime(batch['FB_CREATESERVICETSTAMP'], unit='s', errors='coerce')
+        batch['FB_SERVICE_DATE'] = parse_service_dates(batch['FB_SERVICE_DATE'])
+        batch = batch.dropna(subset=['FB_CREATESERVICETSTAMP', 'FB_SERVICE_DATE'])
+    for col in DATE_COLUMNS:
+        if batch[col].dtype != "datetime64[ns]":
+            batch[col] = batch[col].astype("datetime64[ns]")
+    return batch
+
+def compact_batch(batch):
+    """
+    Shrink a converted result batch according to the storage schema: CATEGORY_COLUMNS
+    become category and INTEGER_COLUMNS are downcast to the smallest integer type.
+    :param batch: Converted pandas batch of query results
+    :return: Tuple of (compacted batch, dictionary of bytes saved per column)
+    """
+    saved = {}
+    for col in batch.columns:
+        before = batch[col].memory_usage(index=False, deep=True)
+        if col in CATEGORY_COLUMNS:
+            batch[col] = batch[col].astype("category")
+        elif col in INTEGER_COLUMNS and pd.api.types.is_integer_dtype(batch[col]):
+            batch[col] = pd.to_numeric(batch[col], downcast="integer")
+        else:
+            continue
+        saved[col] = before - batch[col].memory_usage(index=False, deep=True)
+    return batch, saved
+
+def unify_categories(batches):
+    """
+    Return the dtypes that give every categorical column the same categories across batches,
+    so concatenating the batches keeps those columns categorical.
+    :param batches: List of compacted pandas batches
+    :return: Dictionary of column name to CategoricalDtype
+    """
+    dtypes = {}
+    for col in batches[0].columns:
+        if isinstance(batches[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([batch[col] for batch in batches]).categories
+            dtypes[col] = pd.CategoricalDtype(categories)
+    return dtypes
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of this process in bytes, or None where the
+    resource module is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def load_batches(snow_df):
+    """
+    Stream a Snowpark DataFrame into pandas batch by batch, so the full Arrow result
+    and the full pandas frame never exist at the same time. Each batch is converted
+    and trimmed as it arrives. Unless the query already deduplicated (DEDUP_IN_QUERY),
+    rows repeating a KEY_COLUMNS value are dropped, across batches by 64-bit hashes of
+    the key. With COMPACT_DTYPES each batch is also compacted (see compact_batch) and
+    the bytes saved per column are recorded.
+    :param snow_df: Snowpark DataFrame to load
+    :return: Tuple of (pandas DataFrame, load statistics dictionary)
+    """
+    batches = []
+    hashes = []
+    raw_rows = 0
+    compaction = {}
+    for batch in snow_df.to_pandas_batches():
+        raw_rows += len(batch)
+        if not DEDUP_IN_QUERY:
+            batch = batch.drop_duplicates(subset=KEY_COLUMNS)
+            hashes.append(pd.util.hash_pandas_object(batch[KEY_COLUMNS], index=False))
+        batch = prepare_batch(batch)
+        if COMPACT_DTYPES:
+            batch, saved = compact_batch(batch)
+            for col, nbytes in saved.items():
+                compaction[col] = compaction.get(col, 0) + nbytes
+        batches.append(batch)
+        if hashes:
+            hashes[-1] = hashes[-1].loc[batch.index].to_numpy()
+
+    if not batches:
+        return None, {"batches": 0, "raw_rows": 0, "rows": 0, "peak_rss_bytes": peak_rss_bytes()}
+
+    # Drop keys already seen in an earlier batch before concatenating
+    if hashes:
+        duplicated = pd.Series(np.concatenate(hashes)).duplicated().to_numpy()
+        offsets = np.cumsum([len(batch) for batch in batches])[:-1]
+        batches = [batch[~dup] for batch, dup in zip(batches, np.split(duplicated, offsets))]
+    category_dtypes = unify_categories(batches)
+    batches = [batch.astype(category_dtypes) for batch in batches]
+    df = pd.concat(batches, ignore_index=True)
+
+    stats = {
+        "batches": len(batches),
+        "raw_rows": raw_rows,
+        "rows": len(df),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "bytes_saved": compaction
+    }
+    return df, stats
+
+def run_query(query, params=None):
     """
     Executes a SQL query on the Snowflake session and returns the results as a pandas DataFrame.
-    Caches the DataFrame to avoid reloading on every execution.
+    Results are streamed in batches (see load_batches) and the load statistics are
+    attached to the DataFrame as attrs["load_stats"].
+    :param query: SQL query string, optionally with ? placeholders
+    :param params: Tuple of values bound to the query placeholders
     """
     session = get_session()
     if session is None:
         st.error("Session is not initialized.")
         return None
     try:
-        snow_df = session.sql(query).to_pandas()
-        snow_df = snow_df.drop_duplicates()
-
-        # Convert relevant columns to datetime with error handling
-        snow_df['FB_CREATESERVICETSTAMP'] = pd.to_datetime(snow_df['FB_CREATESERVICETSTAMP'], unit='s', errors='coerce')
-        snow_df['FB_SERVICE_DATE'] = pd.to_datetime(snow_df['FB_SERVICE_DATE'], format='%m/%d/%Y', errors='coerce')
-        
-        # Handle missing or erroneous dates by dropping or setting a default date
-        snow_df.dropna(subset=['FB_CREATESERVICETSTAMP', 'FB_SERVICE_DATE'], inplace=True)
-        
+        snow_df, stats = load_batches(session.sql(query, params=list(params) if params else None))
+        if snow_df is None:
+            # Empty result: keep the column layout pages expect
+            snow_df = prepare_batch(session.sql(query, params=list(params) if params else None).limit(0).to_pandas())
+        snow_df.attrs["load_stats"] = stats
         return snow_df
     except Exception as e:
         st.error(f"Failed to execute query or process data: {str(e)}")
         return None
 
-@st.cache_data(show_spinner=False)
-def filter_data(df, filters):
+@bounded_cache()
+def get_dataframe(query, params=None):
+    """
+    Executes a SQL query (see run_query) and returns the results as a pandas DataFrame.
+    Caches the DataFrame in the bounded cache to avoid reloading on every execution.
+    :param query: SQL query string, optionally with ? placeholders
+    :param params: Tuple of values bound to the query placeholders
+    """
+    return run_query(query, params)
+
+def load_summary(df):
+    """
+    Describe how a dataframe returned by get_dataframe was loaded, as markdown.
+    :param df: Dataframe returned by get_dataframe
+    """
+    stats = df.attrs.get("load_stats")
+    if not stats:
+        return "No load statistics available."
+    if stats.get("snapshot"):
+        lines = [f"Rows loaded: {stats['rows']:,} from the local snapshot"]
+    else:
+        lines = [
+            f"Rows loaded: {stats['rows']:,} of {stats['raw_rows']:,} fetched",
+            f"Batches: {stats['batches']:,}",
+            f"Memory saved by compact dtypes: {sum(stats.get('bytes_saved', {}).values()) / 2**20:,.1f} MB"
+        ]
+    if stats.get("peak_rss_bytes") is not None:
+        lines.append(f"Peak process memory: {stats['peak_rss_bytes'] / 2**20:,.0f} MB")
+    lines += [f"Dataset {name}: {nbytes / 2**20:,.1f} MB in memory" for name, nbytes in dataset_sizes().items()]
+    cache = cache_stats()
+    lines.append(f"Cache: {cache['entries']:,} entries, {cache['bytes'] / 2**20:,.1f} of {cache['max_bytes'] / 2**20:,.0f} MB;"
+                 f" {cache['hits']:,} hits, {cache['misses']:,} misses, {cache['evictions']:,} evictions,"
+                 f" {cache['oversize']:,} too large to cache")
+    return "\n".join(f"- {line}" for line in lines)
+
+def get_filtered_dataframe(columns, metrics=(), filters=None):
+    """
+    Load the book-transaction data with the given filters applied.
+    With FILTER_PUSHDOWN the filters become bound WHERE predicates, so Snowflake
+    prunes partitions and only matching rows are returned; the result is cached
+    per canonical filter set. Otherwise the full join is loaded and filtered in pandas.
+    :param columns: List of column aliases from COLUMNS
+    :param metrics: List of metric column aliases from COLUMNS
+    :param filters: A dictionary of filters to apply
+    :return: Filtered dataframe, or None if loading failed
+    """
+    filters = filters or {}
+    if not FILTER_PUSHDOWN:
+        df = get_dataframe(build_query(columns, metrics))
+        return None if df is None else filter_data(df, filters)
+    predicates, params = build_predicates(filters)
+    return get_dataframe(build_query(columns, metrics, predicates), tuple(params))
+
+# Named datasets pages load, with the columns and metrics each one selects.
+DATASETS = {
+    "book_trans_enriched": {
+        "columns": DIMENSION_COLUMNS + ["FB_EMAIL", "FB_VISIT_ID", "FB_MODSERVICETSTAMP"],
+        "metrics": METRIC_COLUMNS
+    }
+}
+
+# In-memory size in bytes of each dataset loaded in this process.
+DATASET_BYTES = {}
+
+# Lightweight reference to one version of a loaded dataset, used as a cache key in
+# place of hashing the dataframe. The version changes whenever refresh_dataset
+# replaces the data, so results cached for an older version are never returned.
+DatasetHandle = namedtuple("DatasetHandle", ["name", "version", "rows"])
+DATASET_VERSIONS = itertools.count(1)
+
+# Keep an Arrow snapshot of each loaded dataset on local disk, so a restarted process
+# can start from it instead of rerunning the warehouse join. Bump SNAPSHOT_VERSION
+# whenever the loaded layout changes. Snapshots hold guest emails, so the directory
+# (BI_SNAPSHOT_DIR, by default one per user, see snapshot_dir) and the files in it are
+# readable by the owner only.
+SNAPSHOTS = True
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.environ.get("BI_SNAPSHOT_DIR")
+
+def snapshot_dir():
+    """
+    Return the snapshot directory: SNAPSHOT_DIR, or else a directory of the current
+    user under the system temporary directory, named by user ID where the user has
+    no login name (as in containers running as an arbitrary UID).
+    """
+    if SNAPSHOT_DIR:
+        return SNAPSHOT_DIR
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = os.getuid()
+    return os.path.join(tempfile.gettempdir(), f"bi_streamlit_snapshots_{user}")
+
+def snapshot_path(name):
+    """
+    Return the snapshot file path of a named dataset.
+    """
+    return os.path.join(snapshot_dir(), f"{name}.arrow")
+
+def freshness_token(tables):
+    """
+    Return a token that changes whenever any of the given source tables changes,
+    built from SYSTEM$LAST_CHANGE_COMMIT_TIME of each table.
+    :param tables: Iterable of table aliases from TABLES
+    :return: Token string, or None if it could not be read
+    """
+    session = get_session()
+    if session is None:
+        return None
+    try:
+        aliases = sorted(tables)
+        columns = ", ".join(f"SYSTEM$LAST_CHANGE_COMMIT_TIME('{TABLES[alias]}')" for alias in aliases)
+        row = session.sql(f"SELECT {columns}").collect()[0]
+        return ";".join(f"{alias}={value}" for alias, value in zip(aliases, row))
+    except Exception:
+        return None
+
+def snapshot_header(name, query, token, watermark=None):
+    """
+    Build the header stored in a snapshot's schema metadata. A snapshot is only used
+    when its version, dataset name, query and freshness token all match.
+    """
+    return {
+        "version": SNAPSHOT_VERSION,
+        "dataset": name,
+        "query_sha256": hashlib.sha256(query.encode("utf-8")).hexdigest(),
+        "freshness_token": token,
+        "watermark": watermark
+    }
+
+def write_snapshot(name, query, token, df, watermark=None):
+    """
+    Write a dataset to an uncompressed Arrow IPC (Feather v2) file, so it can be
+    memory-mapped on load, with the snapshot header in the schema metadata.
+    The file is written under a temporary name and renamed into place.
+    Failures are ignored: the snapshot is only an optimization.
+    """
+    try:
+        directory = snapshot_dir()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"bi_snapshot"] = json.dumps(snapshot_header(name, query, token, watermark)).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+        path = snapshot_path(name)
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        # Create the file owner-only up front rather than narrowing it after the write
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+        with os.fdopen(fd, "wb") as sink:
+            feather.write_feather(table, sink, compression="uncompressed")
+        os.replace(path + ".tmp", path)
+    except Exception:
+        pass
+
+def read_snapshot(name, query, token):
+    """
+    Load a dataset snapshot through a memory-mapped Arrow file if its header matches
+    the current version, query and freshness token.
+    :return: Tuple of (dataframe, header), or (None, None) if there is no usable snapshot
+    """
+    try:
+        path = snapshot_path(name)
+        if not os.path.exists(path):
+            return None, None
+        with pa.memory_map(path, "r") as source:
+            reader = pa.ipc.open_file(source)
+            header = json.loads((reader.schema.metadata or {}).get(b"bi_snapshot", b"{}"))
+            if header != dict(snapshot_header(name, query, token), watermark=header.get("watermark")):
+                return None, None
+            df = reader.read_all().to_pandas()
+    except Exception:
+        return None, None
+    df.attrs["load_stats"] = {
+        "batches": 0,
+        "raw_rows": len(df),
+        "rows": len(df),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "bytes_saved": {},
+        "snapshot": path
+    }
+    return df, header
+
+@st.cache_resource(show_spinner=False)
+def load_dataset(name):
+    """
+    Load a named dataset from DATASETS. The entry is cached as a resource, so exactly
+    one copy lives per process and every page and session shares it.
+    :param name: Key of DATASETS
+    :return: Dictionary with the dataframe under "df" (None if loading failed), the
+             change watermark under "watermark" and a process-wide load counter under
+             "version";
+             refresh_dataset replaces them in place
+    """
+    spec = DATASETS[name]
+    query = build_query(spec["columns"], spec["metrics"])
+    token = freshness_token(query_tables(selected_columns(spec["columns"], spec["metrics"]))) if SNAPSHOTS else None
+    df, _ = read_snapshot(name, query, token) if token else (None, None)
+    if df is None:
+        df = run_query(query)
+        if df is not None and token:
+            write_snapshot(name, query, token, df, dataset_watermark(df))
+    entry = {"df": df, "watermark": None if df is None else dataset_watermark(df),
+             "version": next(DATASET_VERSIONS)}
+    if df is not None:
+        DATASET_BYTES[name] = int(df.memory_usage(index=True, deep=True).sum())
+        # Filtered loads pushed down before now are answered from this copy from here on
+        get_dataframe.clear()
+    return entry
+
+def get_dataset(name, filters=None):
+    """
+    Return a named dataset from DATASETS, optionally filtered.
+    Without filters the shared in-process copy from load_dataset is returned; callers
+    must not modify it in place. Filters are answered by slicing that copy through its
+    time and filter indexes (see filter_data). Only while the dataset is not loaded in
+    this process, and with FILTER_PUSHDOWN, are just the matching rows loaded from
+    Snowflake instead (see get_filtered_dataframe).
+    :param name: Key of DATASETS
+    :param filters: A dictionary of filters to apply
+    :return: Dataframe, or None if loading failed
+    """
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset: {name}")
+    if not filters or not canonical_filters(filters):
+        return load_dataset(name)["df"]
+    if FILTER_PUSHDOWN and name not in DATASET_BYTES:
+        spec = DATASETS[name]
+        return get_filtered_dataframe(spec["columns"], spec["metrics"], filters)
+    handle = dataset_handle(name)
+    return None if handle is None else filter_data(handle, filters)
+
+def dataset_handle(name):
+    """
+    Return a handle to the currently loaded version of a named dataset.
+    :param name: Key of DATASETS
+    :return: DatasetHandle, or None if loading failed
+    """
+    entry = load_dataset(name)
+    if entry["df"] is None:
+        return None
+    return DatasetHandle(name, entry["version"], len(entry["df"]))
+
+def dataset_frame(handle):
+    """
+    Return the dataframe a dataset handle refers to.
+    :param handle: DatasetHandle from dataset_handle
+    :return: Dataframe of the handle's dataset
+    """
+    entry = load_dataset(handle.name)
+    if entry["version"] != handle.version:
+        raise ValueError(f"Dataset {handle.name} has been refreshed since version {handle.version}")
+    return entry["df"]
+
+def dataset_watermark(df):
+    """
+    Return the latest modification time loaded in a dataset, in epoch seconds.
+    Rows never modified count by their creation time.
+    :param df: Dataframe loaded for a registry dataset
+    :return: Epoch seconds, or None for an empty dataset
+    """
+    if df.empty:
+        return None
+    created = (df['FB_CREATESERVICETSTAMP'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    return int(df['FB_MODSERVICETSTAMP'].fillna(created).max())
+
+def upsert_rows(df, changes, key):
+    """
+    Replace the rows of df whose key appears in changes and append the new ones.
+    :param df: Current dataframe
+    :param changes: Dataframe of new and changed rows with the same columns
+    :param key: Name of the business key column
+    :return: Combined dataframe
+    """
+    if changes.empty:
+        return df
+    kept = df[~df[key].isin(changes[key])]
+    dtypes = unify_categories([kept, changes])
+    combined = pd.concat([kept.astype(dtypes), changes.astype(dtypes)], ignore_index=True)
+    combined.attrs = dict(df.attrs)
+    return combined
+
+def refresh_dataset(name):
+    """
+    Bring a loaded dataset up to date by fetching only the transactions created or
+    modified since its watermark and upserting them by FB_BOOK_TRANS_WID.
+    Deleted transactions and changes to dimension rows are only picked up by clear_cache.
+    Filtered views are sliced from the refreshed rows (see get_dataset); filtered loads
+    pushed down before the dataset was loaded and cached rollups are dropped.
+    :param name: Key of DATASETS
+    :return: Number of new or changed rows, or None if the refresh failed
+    """
+    loaded = name in DATASET_BYTES
+    entry = load_dataset(name)
+    if not loaded and entry["df"] is not None:
+        # The dataset was only loaded just now, so it is already current
+        return len(entry["df"])
+    spec = DATASETS[name]
+    query = build_query(spec["columns"], spec["metrics"])
+    # Read the token before fetching, so changes made during the refresh invalidate the snapshot
+    token = freshness_token(query_tables(selected_columns(spec["columns"], spec["metrics"]))) if SNAPSHOTS else None
+    if entry["df"] is None or entry["watermark"] is None:
+        # Nothing loaded to build on, so reload in full
+        df = changes = run_query(query)
+    else:
+        predicates = ["(fb.MODSERVICETSTAMP >= ? OR fb.CREATESERVICETSTAMP >= ?)"]
+        changes = run_query(build_query(spec["columns"], spec["metrics"], predicates),
+                            (entry["watermark"], entry["watermark"]))
+        df = None if changes is None else upsert_rows(entry["df"], changes, KEY_COLUMNS[0])
+    if changes is None:
+        return None
+
+    entry["df"] = df
+    entry["watermark"] = dataset_watermark(df)
+    entry["version"] = next(DATASET_VERSIONS)
+    DATASET_BYTES[name] = int(df.memory_usage(index=True, deep=True).sum())
+    if token:
+        write_snapshot(name, query, token, df, entry["watermark"])
+    get_dataframe.clear()
+    filter_data.clear()
+    return len(changes)
+
+def dataset_sizes():
+    """
+    Return the in-memory size in bytes of each dataset loaded in this process.
+    """
+    return dict(DATASET_BYTES)
+
+@bounded_cache(ttl=600,
+               key=lambda data, filters: (data if isinstance(data, DatasetHandle) else None, canonical_filters(filters)),
+               frame=lambda data, filters: None if isinstance(data, DatasetHandle) else data)
+def filter_data(data, filters):
     """
     Apply filters to the dataframe based on the given filter criteria.
-    :param df: Original dataframe
+    Results are cached in the bounded cache per canonical filter set and either the
+    dataset handle or, for other frames, the frame's identity, so a lookup never hashes
+    the data. The date range is a slice of the frame's time index and each dimension
+    narrows those row positions through the filter index, so the cost of a filter
+    follows the size of its result and only the matching rows are copied.
+    :param data: DatasetHandle from dataset_handle, or an original dataframe
     :param filters: A dictionary of filters to apply
-    :return: Filtered dataframe
+    :return: Filtered dataframe; the original frame itself when no filter applies
     """
-    df_filtered = df.copy()
+    df = dataset_frame(data) if isinstance(data, DatasetHandle) else data
+    if not canonical_filters(filters):
+        return df
+    rows = None
 
     if filters.get("date_range"):
-        date_col = filters["date_column"]
         start_date, end_date = filters["date_range"]
-        df_filtered = df_filtered[(df_filtered[date_col] >= pd.Timestamp(start_date)) & 
-                                  (df_filtered[date_col] <= pd.Timestamp(end_date))]
-
-    if filters.get("corporate_entity"):
-        df_filtered = df_filtered[df_filtered["VN_CORPORATE_ENTITY_NAME"].isin(filters["corporate_entity"])]
-    
-    if filters.get("management_entity"):
-        df_filtered = df_filtered[df_filtered["VN_MANAGEMENT_ENTITY_NAME"].isin(filters["management_entity"])]
-    
-    if filters.get("venue"):
-        df_filtered = df_filtered[df_filtered["VN_VENUE_NAME"].isin(filters["venue"])]
-    
-    if filters.get("venue_type"):
-        df_filtered = df_filtered[df_filtered["VN_VENUE_TYPE_NAME"].isin(filters["venue_type"])]
-    
-    if filters.get("global_type"):
-        df_filtered = df_filtered[df_filtered["FB_GLOBALTYPE_DESC"].isin(filters["global_type"])]
-    
-    if filters.get("pay_type"):
-        df_filtered = df_filtered[df_filtered["FB_PAYTYPE_DESC"].isin(filters["pay_type"])]
-    
-    if filters.get("pay_status"):
-        df_filtered = df_filtered[df_filtered["FB_PAYACTION_DESC"].isin(filters["pay_status"])]
-    
-    return df_filtered
+        rows = date_rows(df, filters["date_column"], start_date, end_date)
+
+    for key, col in FILTER_COLUMNS.items():
+        if filters.get(key):
+            rows = value_rows(df, col, filters[key], rows)
+
+    # Materialize the matching rows once, after every predicate is applied
+    return df.take(rows)
+
+# Order in which the sidebar multiselects narrow each other's options.
+CASCADE_ORDER = ["corporate_entity", "management_entity", "venue_type", "global_type", "pay_type", "venue", "pay_status"]
+
+@bounded_cache(ttl=None, key=lambda df: (), frame=lambda df: df)
+def build_filter_index(df):
+    """
+    Build the index the cascading filters are answered from. For each filter column it
+    holds the value code of every row (0 for missing values) and the row positions
+    grouped by value, so the rows of a value are rows[offsets[code]:offsets[code + 1]].
+    The index is built once per dataset frame and kept in the bounded cache.
+    :param df: Dataframe with the FILTER_COLUMNS
+    :return: Dictionary of filter column -> {"values", "codes", "rows", "offsets"}
+    """
+    index = {}
+    position_type = np.int32 if len(df) < 2 ** 31 else np.int64
+    for col in DIMENSION_COLUMNS:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            codes, values = df[col].cat.codes.to_numpy(), df[col].cat.categories
+        else:
+            codes, values = pd.factorize(df[col], sort=True)
+        codes = codes.astype(np.int16 if len(values) < 2 ** 15 - 1 else np.int32) + 1
+        counts = np.bincount(codes, minlength=len(values) + 1)
+        index[col] = {
+            "values": values,
+            "codes": codes,
+            "rows": np.argsort(codes, kind="stable").astype(position_type),
+            "offsets": np.concatenate([[0], np.cumsum(counts)])
+        }
+    return index
+
+@bounded_cache(ttl=None, key=lambda df: (), frame=lambda df: df)
+def build_time_index(df):
+    """
+    Build the index date ranges are answered from: for each date column, the row
+    positions in date order and the dates in that order, with missing dates last.
+    A date range is then a binary search and a contiguous slice of positions.
+    The index is built once per dataset frame and kept in the bounded cache; the date
+    ranges the pages pick are sliced from the registry copy's index (see get_dataset).
+    :param df: Dataframe with the DATE_COLUMNS
+    :return: Dictionary of date column -> {"rows", "dates"}
+    """
+    index = {}
+    position_type = np.int32 if len(df) < 2 ** 31 else np.int64
+    for col in DATE_COLUMNS:
+        dates = df[col].to_numpy()
+        order = np.argsort(dates, kind="stable")
+        index[col] = {"rows": order.astype(position_type), "dates": dates[order]}
+    return index
+
+def date_rows(df, col, start_date, end_date):
+    """
+    Return the positions of the rows whose date lies between the given bounds, inclusive.
+    :param df: Dataframe the time index is built on
+    :param col: Column from DATE_COLUMNS
+    :param start_date: First date of the range
+    :param end_date: Last date of the range
+    :return: Sorted array of row positions
+    """
+    index = build_time_index(df)[col]
+    start = np.searchsorted(index["dates"], pd.Timestamp(start_date).to_datetime64(), side="left")
+    end = np.searchsorted(index["dates"], pd.Timestamp(end_date).to_datetime64(), side="right")
+    return np.sort(index["rows"][start:end])
+
+def cascade_keys(filters, keys):
+    """
+    Return the cache key of a cascade step: the canonical selections of the given keys.
+    """
+    return canonical_filters({key: filters.get(key) for key in keys})
+
+@bounded_cache(ttl=600, key=lambda df, filters, keys=tuple(CASCADE_ORDER): cascade_keys(filters, keys),
+               frame=lambda df, filters, keys=tuple(CASCADE_ORDER): df)
+def cascade_rows(df, filters, keys=tuple(CASCADE_ORDER)):
+    """
+    Return the positions of the rows matching the selections of the given filter keys.
+    The rows of the last selected key are intersected with the (cached) rows of the keys
+    before it, so a step costs time proportional to those rows, not to the whole frame.
+    :param df: Dataframe the filter index is built on
+    :param filters: A dictionary of filters as returned by get_filters
+    :param keys: Filter keys from FILTER_COLUMNS to apply
+    :return: Sorted array of row positions, or None when nothing is selected
+    """
+    keys = tuple(key for key in keys if filters.get(key))
+    if not keys:
+        return None
+    return value_rows(df, FILTER_COLUMNS[keys[-1]], filters[keys[-1]], cascade_rows(df, filters, keys[:-1]))
+
+def value_rows(df, col, values, rows=None):
+    """
+    Return the positions of the rows whose filter column holds one of the given values.
+    :param df: Dataframe the filter index is built on
+    :param col: Column from FILTER_COLUMNS
+    :param values: Selected values
+    :param rows: Sorted row positions to search within, or None for all rows
+    :return: Sorted array of row positions
+    """
+    index = build_filter_index(df)[col]
+    codes = index["values"].get_indexer(list(values))
+    codes = np.unique(codes[codes >= 0]) + 1
+    selected = np.zeros(len(index["values"]) + 1, dtype=bool)
+    selected[codes] = True
+    if rows is not None:
+        return rows[selected[index["codes"][rows]]]
+    if not len(codes):
+        # None of the selected values is in the frame
+        return np.array([], dtype=index["rows"].dtype)
+    postings = [index["rows"][index["offsets"][code]:index["offsets"][code + 1]] for code in codes]
+    if len(postings) == 1:
+        return postings[0]
+    if sum(len(posting) for posting in postings) > len(df) // 8:
+        # Selections covering much of the frame are cheaper to scan than to merge
+        return np.flatnonzero(selected[index["codes"]]).astype(index["rows"].dtype)
+    return np.sort(np.concatenate(postings))
+
+# Largest dimension catalog kept, as a fraction of the rows it summarizes. Beyond it
+# the catalog saves little over the row index and the options are counted from that.
+CATALOG_MAX_RATIO = 0.1
+
+@bounded_cache(ttl=None, key=lambda df: (), frame=lambda df: df)
+def build_dimension_catalog(df):
+    """
+    Build the catalog of distinct combinations of the filter columns in a dataset frame,
+    with the number of rows holding each. The sidebar options and their counts are
+    answered from it, so they cost time in the number of combinations, usually a few
+    thousand, rather than in the number of transactions.
+    The combinations are those of the frame's aggregate cube (see build_cube).
+    :param df: Dataframe with the FILTER_COLUMNS
+    :return: Dataframe with the DIMENSION_COLUMNS and a ROWS column, or None if it has
+             more than CATALOG_MAX_RATIO rows per dataset row
+    """
+    catalog = build_cube(df)["combinations"]
+    return None if len(catalog) > CATALOG_MAX_RATIO * len(df) else catalog
+
+@bounded_cache(ttl=600, key=lambda df, filters, key, order=tuple(CASCADE_ORDER): (key, cascade_keys(filters, order[:list(order).index(key)])),
+               frame=lambda df, filters, key, order=tuple(CASCADE_ORDER): df)
+def cascade_options(df, filters, key, order=tuple(CASCADE_ORDER)):
+    """
+    Return the values a sidebar multiselect offers, given the selections made in the
+    multiselects before it, with the number of matching rows holding each value.
+    :param df: Dataframe the dimension catalog and filter index are built on
+    :param filters: A dictionary of filters as returned by get_filters
+    :param key: Filter key from FILTER_COLUMNS of the multiselect
+    :param order: Filter keys in the order the page shows them
+    :return: Dictionary of value -> row count, in sorted value order
+    """
+    upstream = order[:list(order).index(key)]
+    catalog = build_dimension_catalog(df)
+    if catalog is None:
+        # Count the matching rows through the filter index instead
+        index = build_filter_index(df)[FILTER_COLUMNS[key]]
+        rows = cascade_rows(df, filters, tuple(upstream))
+        counts = np.diff(index["offsets"]) if rows is None else np.bincount(index["codes"][rows], minlength=len(index["values"]) + 1)
+        counts = pd.Series(counts[1:], index=index["values"])
+    else:
+        mask = np.ones(len(catalog), dtype=bool)
+        for upstream_key in upstream:
+            if filters.get(upstream_key):
+                mask &= catalog[FILTER_COLUMNS[upstream_key]].isin(filters[upstream_key]).to_numpy()
+        counts = catalog[mask].groupby(FILTER_COLUMNS[key], observed=True)["ROWS"].sum()
+    return dict(sorted((value, int(count)) for value, count in counts.items() if count))
+
+def option_label(options):
+    """
+    Return a multiselect format_func showing each option with its row count.
+    :param options: Dictionary of value -> row count from cascade_options
+    """
+    return lambda value: f"{value} ({options.get(value, 0):,})"
+
+def cascade_frame(df, filters, keys=tuple(CASCADE_ORDER)):
+    """
+    Return the rows of the dataframe matching the selections of the given filter keys.
+    Only the row positions are cached, so the frame is not kept alive by the cache.
+    :param df: Dataframe the filter index is built on
+    :param filters: A dictionary of filters as returned by get_filters
+    :param keys: Filter keys from FILTER_COLUMNS to apply
+    :return: Filtered dataframe; df itself when nothing is selected
+    """
+    rows = cascade_rows(df, filters, tuple(keys))
+    return df if rows is None else df.take(rows)
+
+def cascade_count(df, filters, keys=tuple(CASCADE_ORDER)):
+    """
+    Return the number of rows matching the selections of the given filter keys, without
+    materializing them as cascade_frame does.
+    :param df: Dataframe the filter index is built on
+    :param filters: A dictionary of filters as returned by get_filters
+    :param keys: Filter keys from FILTER_COLUMNS to apply
+    :return: Number of matching rows
+    """
+    rows = cascade_rows(df, filters, tuple(keys))
+    return len(df) if rows is None else len(rows)
+
+# Output key columns for each time grain the pages aggregate by.
+TIME_GRAINS = {
+    "day": ["Date"],
+    "month": ["YearMonth"],
+    "day_of_week": ["DayOfWeek", "YearMonth"],
+    "season": ["YearSeason"]
+}
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Calendar of the time buckets. SEASONS lists the months of each season, in the order
+# the seasons follow within a year; a season is labelled with the calendar year of its
+# months. The fiscal year starts on the first day of month FISCAL_YEAR_START and is
+# named after the calendar year it ends in.
+SEASONS = {
+    'Winter': [12, 1, 2],
+    'Spring': [3, 4, 5],
+    'Summer': [6, 7, 8],
+    'Fall': [9, 10, 11]
+}
+FISCAL_YEAR_START = int(os.environ.get("BI_FISCAL_YEAR_START", "1"))
+
+# Time buckets of time_bucket, and the buckets of each time grain's key columns.
+TIME_BUCKETS = ["day", "week", "month", "day_of_week", "season", "fiscal_year", "fiscal_quarter"]
+GRAIN_BUCKETS = {
+    "day": ["day"],
+    "month": ["month"],
+    "day_of_week": ["day_of_week", "month"],
+    "season": ["season"]
+}
+
+def bucket_labels(keys, bucket):
+    """
+    Label the integer keys of a time bucket, as computed by time_bucket.
+    :param keys: Array of distinct bucket keys
+    :param bucket: Name from TIME_BUCKETS
+    :return: List of labels, one per key
+    """
+    if bucket == "day":
+        return list(pd.to_datetime(keys.astype('datetime64[D]')).date)
+    if bucket == "week":
+        # Weeks start on Monday and are labelled with their first day
+        return list(pd.to_datetime((keys * 7 - 3).astype('datetime64[D]')).strftime('%Y-%m-%d'))
+    if bucket == "month":
+        return [f"{key // 12 + 1970:04d}-{key % 12 + 1:02d}" for key in keys]
+    if bucket == "day_of_week":
+        return [DAY_ORDER[key] for key in keys]
+    if bucket == "season":
+        names = list(SEASONS)
+        return [f"{key // len(names)} {names[key % len(names)]}" for key in keys]
+    if bucket == "fiscal_year":
+        return [f"FY{key}" for key in keys]
+    if bucket == "fiscal_quarter":
+        return [f"FY{key // 4} Q{key % 4 + 1}" for key in keys]
+    raise ValueError(f"Unknown time bucket: {bucket}")
+
+def time_bucket(dates, bucket):
+    """
+    Bucket timestamps by computing an integer key per row from the datetime64 values,
+    so no per-row strings are built. Only the distinct keys are labelled.
+    :param dates: Series of datetime64 values
+    :param bucket: Name from TIME_BUCKETS
+    :return: Ordered categorical Series aligned with dates whose categories are the
+             labels of the buckets present, in time order; missing dates have no bucket
+    """
+    values = dates.to_numpy()
+    missing = np.isnat(values)
+    days = values.astype('datetime64[D]').astype(np.int64)
+    if bucket in ["month", "season", "fiscal_year", "fiscal_quarter"]:
+        months = values.astype('datetime64[M]').astype(np.int64)
+        years, month_numbers = months // 12 + 1970, months % 12 + 1
+        fiscal_years = years + (month_numbers >= FISCAL_YEAR_START) * (FISCAL_YEAR_START > 1)
+    if bucket == "day":
+        keys = days
+    elif bucket == "week":
+        # Day 0 of the epoch is a Thursday
+        keys = (days + 3) // 7
+    elif bucket == "month":
+        keys = months
+    elif bucket == "day_of_week":
+        keys = (days + 3) % 7
+    elif bucket == "season":
+        season_numbers = np.zeros(13, dtype=np.int64)
+        for number, season_months in enumerate(SEASONS.values()):
+            season_numbers[season_months] = number
+        keys = years * len(SEASONS) + season_numbers[month_numbers]
+    elif bucket == "fiscal_year":
+        keys = fiscal_years
+    elif bucket == "fiscal_quarter":
+        keys = fiscal_years * 4 + (month_numbers - FISCAL_YEAR_START) % 12 // 3
+    else:
+        raise ValueError(f"Unknown time bucket: {bucket}")
+    # Number the keys present densely, in key order, by counting over their range
+    row_codes = np.full(len(values), -1, dtype=np.int64)
+    distinct = np.array([], dtype=np.int64)
+    if not missing.all():
+        offsets = keys[~missing] - keys[~missing].min()
+        present = np.bincount(offsets) > 0
+        distinct = np.flatnonzero(present) + keys[~missing].min()
+        row_codes[~missing] = (np.cumsum(present) - 1)[offsets]
+    categories = pd.Categorical.from_codes(row_codes, categories=bucket_labels(distinct, bucket), ordered=True)
+    return pd.Series(categories, index=dates.index, name=dates.name)
+
+@bounded_cache(ttl=None, key=lambda df, column, bucket: (column, bucket), frame=lambda df, column, bucket: df)
+def time_buckets(df, column, bucket):
+    """
+    Return the time buckets of a dataset column, computed once per dataset frame. As
+    the result keeps the dataset's index, assigning it to rows filtered from the
+    dataset aligns it with them.
+    :param df: Dataset frame
+    :param column: Name from DATE_COLUMNS
+    :param bucket: Name from TIME_BUCKETS
+    :return: Ordered categorical Series, as time_bucket returns
+    """
+    return time_bucket(df[column], bucket)
+
+def aggregate_frame(df, metrics, grain):
+    """
+    Sum the metrics of a row-level dataframe by a time grain of FB_CREATESERVICETSTAMP.
+    :param df: Dataframe as returned by get_dataframe or filter_data
+    :param metrics: List of metric columns to sum
+    :param grain: Key of TIME_GRAINS
+    :return: Aggregated dataframe with the grain's key columns followed by the metrics,
+             in time order
+    """
+    if grain not in TIME_GRAINS:
+        raise ValueError(f"Unknown time grain: {grain}")
+    keys = [time_bucket(df['FB_CREATESERVICETSTAMP'], bucket).rename(name)
+            for bucket, name in zip(GRAIN_BUCKETS[grain], TIME_GRAINS[grain])]
+    aggregated = df.groupby(keys, observed=True)[list(metrics)].sum().reset_index()
+    # Turn the bucket keys back into their labels
+    for name in TIME_GRAINS[grain]:
+        aggregated[name] = np.asarray(aggregated[name])
+    return aggregated
+
+# Answer the page rollups of an in-memory dataset from its aggregate cube rather than
+# from the row-level data.
+CUBE_AGGREGATION = True
+
+@bounded_cache(ttl=None, key=lambda df: (), frame=lambda df: df)
+def build_cube(df):
+    """
+    Build the aggregate cube of a dataset frame: the METRIC_COLUMNS summed by day of
+    FB_CREATESERVICETSTAMP and distinct combination of the filter columns. Every time
+    grain and filter selection the pages ask for is a rollup of it, so answering them
+    costs time in the size of the cube rather than in the number of transactions.
+    The cube is built once per dataset frame and kept in the bounded cache.
+    :param df: Dataframe with the FILTER_COLUMNS, METRIC_COLUMNS and FB_CREATESERVICETSTAMP
+    :return: Dictionary with the distinct combinations of the DIMENSION_COLUMNS and their
+             row counts under "combinations", and under "cube" a dataframe of day
+             (FB_CREATESERVICETSTAMP), combination number (COMBINATION) and metric sums
+    """
+    groups = df.groupby(DIMENSION_COLUMNS, observed=True, dropna=False)
+    combinations = groups.size().reset_index(name="ROWS")
+    facts = pd.DataFrame({
+        "FB_CREATESERVICETSTAMP": df['FB_CREATESERVICETSTAMP'].dt.normalize(),
+        "COMBINATION": groups.ngroup().astype(np.int32)
+    })
+    facts[METRIC_COLUMNS] = df[METRIC_COLUMNS]
+    cube = facts.groupby(["FB_CREATESERVICETSTAMP", "COMBINATION"], sort=False)[METRIC_COLUMNS].sum().reset_index()
+    return {"combinations": combinations, "cube": cube}
+
+@bounded_cache(ttl=600, key=lambda df, metrics, grain, filters: (metrics, grain, canonical_filters(filters)),
+               frame=lambda df, metrics, grain, filters: df)
+def cube_aggregate(df, metrics, grain, filters):
+    """
+    Roll the aggregate cube of a dataset frame up to a time grain under the filters.
+    A date range on FB_CREATESERVICETSTAMP takes the days it covers whole from the cube
+    and sums the rows of the days it covers in part, so the result matches filtering
+    the rows; get_aggregate does not use the cube for ranges on other columns.
+    :param df: Dataframe the cube is built on
+    :param metrics: Tuple of metric columns from METRIC_COLUMNS to sum
+    :param grain: Key of TIME_GRAINS
+    :param filters: A dictionary of filters as returned by get_filters
+    :return: Aggregated dataframe, as aggregate_frame returns
+    """
+    cube = build_cube(df)
+    combinations = cube["combinations"]
+    selected = np.ones(len(combinations), dtype=bool)
+    for key, col in FILTER_COLUMNS.items():
+        if filters.get(key):
+            selected &= combinations[col].isin(filters[key]).to_numpy()
+    rows = cube["cube"][selected[cube["cube"]["COMBINATION"].to_numpy()]]
+    partial = None
+    if filters.get("date_range"):
+        start, end = (pd.Timestamp(bound) for bound in filters["date_range"])
+        # Days lying whole within the range, inclusive of its end
+        first_day, last_day = start.ceil('D'), (end + pd.Timedelta(1, 'ns')).floor('D') - pd.Timedelta(1, 'D')
+        days = rows["FB_CREATESERVICETSTAMP"]
+        rows = rows[(days >= first_day) & (days <= last_day)]
+        if first_day > last_day:
+            positions = date_rows(df, "FB_CREATESERVICETSTAMP", start, end)
+        else:
+            positions = np.sort(np.concatenate([
+                date_rows(df, "FB_CREATESERVICETSTAMP", start, first_day - pd.Timedelta(1, 'ns')),
+                date_rows(df, "FB_CREATESERVICETSTAMP", last_day + pd.Timedelta(1, 'D'), end)
+            ]))
+        for key, col in FILTER_COLUMNS.items():
+            if filters.get(key):
+                positions = value_rows(df, col, filters[key], positions)
+        partial = df.take(positions)
+        partial = partial[list(metrics)].assign(FB_CREATESERVICETSTAMP=partial['FB_CREATESERVICETSTAMP'].dt.normalize())
+    daily = pd.concat([rows[["FB_CREATESERVICETSTAMP"] + list(metrics)], partial])
+    daily = daily.groupby("FB_CREATESERVICETSTAMP")[list(metrics)].sum().reset_index()
+    return aggregate_frame(daily, metrics, grain)
+
+def get_aggregate(metrics, grain, filters, df):
+    """
+    Return the given metrics summed by a time grain under the given filters.
+    With CUBE_AGGREGATION the rollup comes from the frame's aggregate cube (see
+    cube_aggregate); for a date range on another column than FB_CREATESERVICETSTAMP,
+    or other metrics, the frame is filtered and grouped in pandas.
+    :param metrics: List of metric columns to sum
+    :param grain: Key of TIME_GRAINS
+    :param filters: A dictionary of filters to apply
+    :param df: Row-level dataframe to aggregate
+    :return: Aggregated dataframe
+    """
+    if CUBE_AGGREGATION and set(metrics) <= set(METRIC_COLUMNS):
+        if not (filters.get("date_range") and filters.get("date_column") != "FB_CREATESERVICETSTAMP"):
+            return cube_aggregate(df, tuple(metrics), grain, filters)
+    return aggregate_frame(filter_data(df, filters), metrics, grain)
+
+# A guest (FB_EMAIL) counts as a repeat guest from this many distinct visits.
+REPEAT_MIN_VISITS = 2
+
+def classify_guests(df, min_visits=REPEAT_MIN_VISITS):
+    """
+    Classify the rows of a dataframe by guest in one pass over factorized FB_EMAIL and
+    FB_VISIT_ID codes, instead of a Python call per guest. A guest's visits are ordered
+    by their first FB_CREATESERVICETSTAMP. Rows without an email belong to no guest.
+    :param df: Dataframe with FB_EMAIL, FB_VISIT_ID and FB_CREATESERVICETSTAMP
+    :param min_visits: Number of distinct visits from which a guest is a repeat guest
+    :return: Dataframe aligned with df with the columns GUEST_VISITS (distinct visits of
+             the row's guest), VISIT_NUMBER (1 for the guest's first visit), REPEAT_GUEST
+             and RETURNING (the row belongs to a later visit than the first)
+    """
+    guests, _ = pd.factorize(df['FB_EMAIL'])
+    visits, visit_values = pd.factorize(df['FB_VISIT_ID'], use_na_sentinel=False)
+    stamps = df['FB_CREATESERVICETSTAMP'].to_numpy().view(np.int64)
+    # Sort the rows by guest and visit, then by time, so each visit starts at its first row
+    pairs = guests.astype(np.int64) * max(len(visit_values), 1) + visits
+    order = np.lexsort((stamps, pairs))
+    sorted_pairs = pairs[order]
+    first_rows = np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]]
+    starts = np.flatnonzero(first_rows)
+    pair_of_row = np.empty(len(df), dtype=np.int64)
+    pair_of_row[order] = np.cumsum(first_rows) - 1
+    # Number each guest's visits by their first timestamp
+    pair_guests = guests[order[starts]]
+    pair_order = np.lexsort((stamps[order[starts]], pair_guests))
+    guest_starts = np.searchsorted(pair_guests[pair_order], pair_guests[pair_order], side='left')
+    visit_number = np.empty(len(starts), dtype=np.int64)
+    visit_number[pair_order] = np.arange(len(starts)) - guest_starts + 1
+    guest_visits = np.zeros(len(starts), dtype=np.int64)
+    known = pair_guests >= 0
+    guest_visits[known] = np.bincount(pair_guests[known])[pair_guests[known]]
+    visit_number[~known] = 0
+    row_visits = guest_visits[pair_of_row]
+    row_number = visit_number[pair_of_row]
+    return pd.DataFrame({
+        "GUEST_VISITS": row_visits,
+        "VISIT_NUMBER": row_number,
+        "REPEAT_GUEST": row_visits >= min_visits,
+        "RETURNING": row_number > 1
+    }, index=df.index)
+
+@bounded_cache(ttl=600, key=lambda df, filters, min_visits=REPEAT_MIN_VISITS: (cascade_keys(filters, CASCADE_ORDER), min_visits),
+               frame=lambda df, filters, min_visits=REPEAT_MIN_VISITS: df)
+def cascade_guests(df, filters, min_visits=REPEAT_MIN_VISITS):
+    """
+    Classify the guests of the rows cascade_frame returns for the given filters. The
+    result is cached on the dataset and the selections, as the filtered frame itself
+    is rebuilt on every rerun.
+    :param df: Dataframe the filter index is built on
+    :param filters: A dictionary of filters as returned by get_filters
+    :param min_visits: Number of distinct visits from which a guest is a repeat guest
+    :return: Dataframe aligned with cascade_frame(df, filters), as from classify_guests
+    """
+    return classify_guests(cascade_frame(df, filters), min_visits)
 
 def clear_cache():
     """
@@ -98,6 +1441,8 @@ def clear_cache():
     """
     st.cache_data.clear()
     st.cache_resource.clear()
+    clear_bounded_cache()
+    DATASET_BYTES.clear()
 
 def get_filters():
     """
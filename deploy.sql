@@ -8,6 +8,8 @@ create or replace stage bi_streamlit_stage;
 
 PUT file:///Users/nitshawacinski/Desktop/bi-streamlit-snowflake/Main.py @bi_streamlit_stage overwrite=true auto_compress=false;
 PUT file:///Users/nitshawacinski/Desktop/bi-streamlit-snowflake/data_store.py @bi_streamlit_stage overwrite=true auto_compress=false;
+PUT file:///Users/nitshawacinski/Desktop/bi-streamlit-snowflake/charts.py @bi_streamlit_stage overwrite=true auto_compress=false;
+PUT file:///Users/nitshawacinski/Desktop/bi-streamlit-snowflake/widgets.py @bi_streamlit_stage overwrite=true auto_compress=false;
 PUT file:///Users/nitshawacinski/Desktop/bi-streamlit-snowflake/pages/*.py @bi_streamlit_stage/pages overwrite=true auto_compress=false;
 
 CREATE OR REPLACE STREAMLIT bi_analytics
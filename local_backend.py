@@ -0,0 +1,328 @@
+"""
+Offline backend for data_store: an in-process DuckDB database holding synthetic
+copies of fact_book_trans, dim_visit, dim_venue and dim_item, behind a small
+adapter that answers the same SQL data_store sends to Snowflake.
+
+Select it with the BI_BACKEND=local environment variable, or run this file to
+benchmark the data_store loading, filtering and aggregation paths:
+
+    python local_backend.py --rows 1000000
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Rows generated and inserted per chunk, so large scales never hold the whole
+# fact table in pandas at once.
+CHUNK_ROWS = 1_000_000
+
+# Rows per Arrow batch returned by LocalDataFrame.to_pandas_batches.
+BATCH_ROWS = 250_000
+
+FIRST_DAY = pd.Timestamp("2021-01-01")
+
+CORPORATE_ENTITIES = ["MGM Resorts", "Caesars Entertainment", "Wynn Resorts", "Las Vegas Sands",
+                      "Hard Rock International", "Station Casinos", "Boyd Gaming", "Red Rock Resorts",
+                      "Penn Entertainment", "Golden Entertainment"]
+VENUE_TYPES = ["Nightclub", "Dayclub", "Restaurant", "Lounge", "Pool", "Bar", "Showroom", "Beach Club"]
+MARKET_AREAS = ["Las Vegas", "Atlantic City", "Miami", "New York", "Los Angeles", "Macau", "Dubai"]
+GLOBAL_TYPES = ["Table", "Ticket", "Bottle Service", "Cabana", "Daybed", "Guest List", "Package"]
+PAY_TYPES = ["Credit Card", "Deposit", "Comp", "House Account", "Gift Card"]
+PAY_ACTIONS = ["Paid", "Refunded", "Pending", "Voided"]
+SOURCE_SYSTEMS = ["PAY", "urcheckout", "LEGACY"]
+VISIT_STATES = ["Booked", "Arrived", "Completed", "No Show", "Cancelled"]
+CANCEL_STATES = ["", "Guest Cancelled", "Venue Cancelled", "Weather"]
+
+def zipf_weights(n, exponent=1.1):
+    """
+    Return normalized Zipf weights for n ranked values, so a few values dominate.
+    """
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def label(prefix, codes):
+    """
+    Build string labels like "Venue 12" for an array of integer codes.
+    """
+    return np.char.add(prefix, codes.astype(str)).astype(object)
+
+def generate_dimensions(rows, seed=0):
+    """
+    Generate the dimension tables for a fact table of the given size. Cardinalities
+    grow with the scale: about one venue per 20,000 transactions (20 to 2,000),
+    one visit per three transactions and one guest per six. About 1% of visits have
+    a second record with the same VISIT_ID.
+    :param rows: Number of fact rows the dimensions will serve
+    :param seed: Random seed
+    :return: Dictionary of table alias ("vs", "vn", "it") to DataFrame, plus the
+             guest count under "guests"
+    """
+    rng = np.random.default_rng(seed)
+    n_venues = int(np.clip(rows // 20_000, 20, 2_000))
+    n_management = max(4, n_venues // 5)
+    n_items = int(np.clip(rows // 2_000, 50, 5_000))
+    n_visits = max(1, rows // 3)
+    n_guests = max(1, rows // 6)
+
+    management_corporate = rng.choice(len(CORPORATE_ENTITIES), n_management, p=zipf_weights(len(CORPORATE_ENTITIES)))
+    venue_management = rng.choice(n_management, n_venues, p=zipf_weights(n_management, 0.8))
+    venues = pd.DataFrame({
+        "VENUE_ID": np.arange(1, n_venues + 1),
+        "VENUE_RECORD_STATUS": rng.choice(["Active", "Inactive"], n_venues, p=[0.9, 0.1]).astype(object),
+        "CORPORATE_ENTITY_NAME": np.array(CORPORATE_ENTITIES, dtype=object)[management_corporate[venue_management]],
+        "MANAGEMENT_ENTITY_NAME": label("Management Group ", venue_management + 1),
+        "VENUE_NAME": label("Venue ", np.arange(1, n_venues + 1)),
+        "VENUE_MARKET_AREA_NAME": np.array(MARKET_AREAS, dtype=object)[rng.choice(len(MARKET_AREAS), n_venues, p=zipf_weights(len(MARKET_AREAS)))],
+        "VENUE_TYPE_NAME": np.array(VENUE_TYPES, dtype=object)[rng.choice(len(VENUE_TYPES), n_venues, p=zipf_weights(len(VENUE_TYPES), 0.7))],
+        "VENUE_CITY": label("City ", rng.integers(1, 60, n_venues)),
+        "VENUE_PROVINCE": label("Province ", rng.integers(1, 20, n_venues)),
+        "VENUE_COUNTRY": rng.choice(["US", "CA", "MX", "AE", "MO"], n_venues, p=[0.8, 0.05, 0.05, 0.05, 0.05]).astype(object)
+    })
+
+    items = pd.DataFrame({
+        "ITEM_ID": np.arange(1, n_items + 1),
+        "ITEM_GLOBALTYPE_CODE": label("GT", rng.integers(1, len(GLOBAL_TYPES) + 1, n_items)),
+        "ITEM_PREFAB": rng.choice(["Y", "N"], n_items).astype(object),
+        "ITEM_PRICINGS": np.char.add('[{"tier": "standard", "price": ', rng.integers(50, 5_000, n_items).astype(str)).astype(object) + '}]',
+        "ITEM_PUBLICNAME": label("Item ", np.arange(1, n_items + 1)),
+        "ITEM_BOOKTYPE_NAME": rng.choice(["Reservation", "Ticket", "Package"], n_items).astype(object),
+        "ITEM_TYPE_CODE_NAME": label("Type ", rng.integers(1, 25, n_items))
+    })
+
+    # Popular venues get most of the visits, and regulars come back often
+    visit_venue = rng.choice(n_venues, n_visits, p=zipf_weights(n_venues)) + 1
+    visits = pd.DataFrame({
+        "VISIT_ID": np.arange(1, n_visits + 1),
+        "VISIT_WID": np.arange(1, n_visits + 1) + 10_000_000,
+        "VENUE_ID": visit_venue,
+        "GUEST_ID": (rng.zipf(1.3, n_visits) - 1) % n_guests,
+        "CURRENTSTATE_DESC": np.array(VISIT_STATES, dtype=object)[rng.choice(len(VISIT_STATES), n_visits, p=[0.2, 0.1, 0.55, 0.05, 0.1])],
+        "COMPAGREE_AMOUNT": np.round(rng.lognormal(3, 1, n_visits), 2),
+        "ORIGINATOR_ID": rng.integers(1, 500, n_visits),
+        "OWNER_ID": rng.integers(1, 500, n_visits),
+        "SPENDAGREE_AMOUNT": np.round(rng.lognormal(6, 1, n_visits), 2),
+        "SOURCE_CODE": rng.choice(["WEB", "APP", "PHONE", "WALKIN"], n_visits, p=[0.5, 0.3, 0.15, 0.05]).astype(object),
+        "CANCELSTATE_DESC": np.array(CANCEL_STATES, dtype=object)[rng.choice(len(CANCEL_STATES), n_visits, p=[0.9, 0.05, 0.03, 0.02])],
+        "SOURCE_LOC": label("https://book.example.com/v/", visit_venue)
+    })
+
+    # About 1% of visits carry a second, later record, so joins on VISIT_ID fan out
+    # the way they can in the warehouse
+    history = visits.sample(frac=0.01, random_state=seed)
+    history = history.assign(VISIT_WID=history["VISIT_WID"] + n_visits, CURRENTSTATE_DESC="Completed")
+    visits = pd.concat([visits, history], ignore_index=True)
+    return {"vs": visits, "vn": venues, "it": items, "guests": n_guests}
+
+def generate_fact_chunk(start, rows, dimensions, seed=0, days=3 * 365):
+    """
+    Generate one chunk of fact_book_trans rows. Transactions cluster on weekends and
+    in summer, most guests book once while a few book often, and a small share of
+    rows carries a missing or malformed SERVICE_DATE.
+    :param start: Row number of the first row in the chunk
+    :param rows: Number of rows to generate
+    :param dimensions: Result of generate_dimensions
+    :param seed: Random seed
+    :param days: Number of days the transactions span, starting at FIRST_DAY
+    :return: DataFrame with the fact_book_trans columns
+    """
+    rng = np.random.default_rng((seed, start))
+    visits = dimensions["vs"]
+    n_items = len(dimensions["it"])
+
+    # Weekly and seasonal demand profile over the whole date span
+    day_index = pd.date_range(FIRST_DAY, periods=days, freq="D")
+    weights = np.where(day_index.dayofweek >= 4, 2.5, 1.0) * (1.0 + 0.5 * np.isin(day_index.month, [6, 7, 8]))
+    day = rng.choice(days, rows, p=weights / weights.sum())
+    created = (FIRST_DAY - pd.Timestamp(0)) // pd.Timedelta(seconds=1) + day * 86_400 + rng.integers(0, 86_400, rows)
+    modified = np.where(rng.random(rows) < 0.2, created + rng.integers(60, 30 * 86_400, rows), np.nan)
+    service_day = pd.to_datetime(created + rng.integers(0, 90, rows) * 86_400, unit="s")
+    service_date = service_day.strftime("%m/%d/%Y").to_numpy(dtype=object)
+    bad = rng.random(rows)
+    service_date[bad < 0.0005] = None
+    service_date[(bad >= 0.0005) & (bad < 0.001)] = "TBD"
+
+    visit_row = rng.integers(0, len(visits), rows)
+    visit_id = visits["VISIT_ID"].to_numpy()[visit_row]
+    guest = visits["GUEST_ID"].to_numpy()[visit_row]
+    wid = np.arange(start + 1, start + rows + 1)
+    subtotal = np.round(rng.lognormal(5, 1.2, rows), 2)
+    item = rng.choice(n_items, rows, p=zipf_weights(n_items)) + 1
+
+    return pd.DataFrame({
+        "BOOK_TRANS_WID": wid,
+        "BOOK_TRANS_ID": wid + 500_000_000,
+        "VISIT_ID": visit_id,
+        "CORPORATE_ENTITY_ID": rng.integers(1, len(CORPORATE_ENTITIES) + 1, rows),
+        "MANAGEMENT_ENTITY_ID": rng.integers(1, 100, rows),
+        "VENUE_ID": visits["VENUE_ID"].to_numpy()[visit_row],
+        "SOURCE_SYSTEMS": np.array(SOURCE_SYSTEMS, dtype=object)[rng.choice(3, rows, p=[0.6, 0.35, 0.05])],
+        "SERVICE_ID": rng.integers(1, 10_000, rows),
+        "CREATESERVICETSTAMP": created,
+        "MODSERVICETSTAMP": modified,
+        "SERVICE_DATE": service_date,
+        "TRANSTIXREF": label("REF", wid),
+        "BILLED_NAME": label("Guest ", guest),
+        "CART_ID": rng.integers(1, max(2, rows), rows) + start,
+        "CHARGE_AMOUNT": np.round(subtotal * rng.uniform(1.0, 1.3, rows), 2),
+        "CITY": label("City ", rng.integers(1, 500, rows)),
+        "COUNTRY_CODE": rng.choice(["US", "CA", "GB", "MX"], rows, p=[0.85, 0.06, 0.05, 0.04]).astype(object),
+        "EMAIL": np.char.add(np.char.add("guest", guest.astype(str)), "@example.com").astype(object),
+        "EVENT_ID": rng.integers(1, 20_000, rows),
+        "GLOBALTYPE_DESC": np.array(GLOBAL_TYPES, dtype=object)[rng.choice(len(GLOBAL_TYPES), rows, p=zipf_weights(len(GLOBAL_TYPES)))],
+        "ITEM_NAME": label("Item ", item),
+        "MASTERITEM_ID": item,
+        "PARTY_ID": rng.integers(1, 1_000_000, rows),
+        "PAYACTION_DESC": np.array(PAY_ACTIONS, dtype=object)[rng.choice(len(PAY_ACTIONS), rows, p=[0.85, 0.07, 0.05, 0.03])],
+        "PAYTYPE_DESC": np.array(PAY_TYPES, dtype=object)[rng.choice(len(PAY_TYPES), rows, p=[0.7, 0.15, 0.08, 0.05, 0.02])],
+        "PLANNED_GUEST_COUNT": np.clip(rng.poisson(5, rows), 1, None),
+        "PRESALE_TRANS_ID": rng.integers(1, 1_000_000, rows),
+        "PROVINCE_CODE": label("P", rng.integers(1, 60, rows)),
+        "SPENDAGREE_AMOUNT": np.round(subtotal * rng.uniform(0.8, 1.5, rows), 2),
+        "SUBTOTAL_AMOUNT": subtotal,
+        "TIXID": rng.integers(1, 1_000_000, rows),
+        "TRANSTIXID": rng.integers(1, 1_000_000, rows),
+        "ZIP": label("", rng.integers(10_000, 99_999, rows))
+    })
+
+def create_database(rows, seed=0, database=":memory:"):
+    """
+    Create a DuckDB database holding synthetic edw.public tables with the given
+    number of fact rows. A database file that already holds that many fact rows
+    is reused as it is.
+    :param rows: Number of fact_book_trans rows, typically 10,000 to 50,000,000
+    :param seed: Random seed
+    :param database: DuckDB database file path, or ":memory:"
+    :return: DuckDB connection
+    """
+    import duckdb
+
+    connection = duckdb.connect()
+    connection.execute(f"ATTACH '{database}' AS edw")
+    connection.execute("CREATE SCHEMA IF NOT EXISTS edw.public")
+    # Snowflake functions used by data_store; only the MM/DD/YYYY format is needed
+    connection.execute("CREATE MACRO TRY_TO_DATE(s, fmt) AS CAST(TRY_STRPTIME(s, '%m/%d/%Y') AS DATE)")
+    connection.execute("CREATE MACRO TO_TIMESTAMP_NTZ(seconds) AS EPOCH_MS(CAST(seconds * 1000 AS BIGINT))")
+
+    existing = connection.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE database_name = 'edw' AND table_name = 'fact_book_trans'").fetchone()[0]
+    if existing and connection.execute("SELECT count(*) FROM edw.public.fact_book_trans").fetchone()[0] == rows:
+        return connection
+
+    dimensions = generate_dimensions(rows, seed)
+    for alias, table in [("vs", "dim_visit"), ("vn", "dim_venue"), ("it", "dim_item")]:
+        frame = dimensions[alias].drop(columns=["GUEST_ID"], errors="ignore")
+        connection.register("frame", frame)
+        connection.execute(f"CREATE OR REPLACE TABLE edw.public.{table} AS SELECT * FROM frame")
+        connection.unregister("frame")
+
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = generate_fact_chunk(start, min(CHUNK_ROWS, rows - start), dimensions, seed)
+        connection.register("chunk", chunk)
+        if start == 0:
+            connection.execute("CREATE OR REPLACE TABLE edw.public.fact_book_trans AS SELECT * FROM chunk")
+        else:
+            connection.execute("INSERT INTO edw.public.fact_book_trans SELECT * FROM chunk")
+        connection.unregister("chunk")
+    return connection
+
+class LocalDataFrame:
+    """
+    The part of the Snowpark DataFrame interface data_store uses, backed by a DuckDB query.
+    """
+
+    def __init__(self, connection, query, params=None):
+        self.connection = connection
+        self.query = query
+        self.params = list(params) if params else []
+
+    def execute(self):
+        # DuckDB connections are not thread-safe; every query gets its own cursor
+        return self.connection.cursor().execute(self.query, self.params)
+
+    def to_pandas(self):
+        return self.execute().df()
+
+    def to_pandas_batches(self):
+        result = self.execute()
+        reader = result.to_arrow_reader(BATCH_ROWS) if hasattr(result, "to_arrow_reader") else result.fetch_record_batch(BATCH_ROWS)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def collect(self):
+        return self.execute().fetchall()
+
+    def limit(self, n):
+        return LocalDataFrame(self.connection, f"SELECT * FROM ({self.query}) LIMIT {int(n)}", self.params)
+
+class LocalSession:
+    """
+    The part of the Snowpark Session interface data_store uses, backed by DuckDB.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def sql(self, query, params=None):
+        return LocalDataFrame(self.connection, query, params)
+
+def create_local_session(rows, seed=0, database=":memory:"):
+    """
+    Create a LocalSession over a synthetic database (see create_database).
+    """
+    return LocalSession(create_database(rows, seed, database))
+
+def benchmark(rows, seed=0, database=":memory:"):
+    """
+    Time the data_store load, filter and aggregation paths against a synthetic
+    database of the given size and print the results.
+    """
+    os.environ["BI_BACKEND"] = "local"
+    import data_store as ds
+
+    ds.BACKEND = "local"
+    ds.SNAPSHOTS = False
+    timings = []
+
+    def timed(label, func):
+        started = time.perf_counter()
+        result = func()
+        timings.append((label, time.perf_counter() - started))
+        return result
+
+    session = timed("generate database", lambda: create_local_session(rows, seed, database))
+    ds.get_session = lambda: session
+    df = timed("load dataset", lambda: ds.get_dataset("book_trans_enriched"))
+    venues = df["VN_VENUE_NAME"].value_counts().index[:3].tolist()
+    filters = {
+        "date_column": "FB_CREATESERVICETSTAMP",
+        "date_range": (FIRST_DAY.date(), (FIRST_DAY + pd.Timedelta(days=30)).date()),
+        "venue": venues
+    }
+    handle = ds.dataset_handle("book_trans_enriched")
+    timed("filter_data (cold)", lambda: ds.filter_data(handle, filters))
+    timed("filter_data (cached)", lambda: ds.filter_data(handle, filters))
+    date_range = {key: filters[key] for key in ("date_column", "date_range")}
+    timed("date range (cold)", lambda: ds.get_dataset("book_trans_enriched", date_range))
+    timed("date range (cached)", lambda: ds.get_dataset("book_trans_enriched", date_range))
+    cascade = lambda: [ds.cascade_options(df, filters, key) for key in ds.CASCADE_ORDER]
+    timed("sidebar cascade (cold)", cascade)
+    timed("sidebar cascade (cached)", cascade)
+    for grain in ds.TIME_GRAINS:
+        timed(f"aggregate by {grain}", lambda: ds.aggregate_frame(df, ds.METRIC_COLUMNS, grain))
+
+    print(f"{rows:,} fact rows, {len(df):,} loaded, {df.memory_usage(deep=True).sum() / 2**20:,.1f} MB in memory")
+    for label, seconds in timings:
+        print(f"{label:<28} {seconds * 1000:>10,.1f} ms")
+    peak = ds.peak_rss_bytes()
+    if peak is not None:
+        print(f"{'peak process memory':<28} {peak / 2**20:>10,.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark data_store against synthetic data.")
+    parser.add_argument("--rows", type=int, default=100_000, help="number of fact_book_trans rows")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--database", default=":memory:", help="DuckDB file to create or reuse")
+    args = parser.parse_args()
+    benchmark(args.rows, args.seed, args.database)
@@ -1,12 +1,27 @@
 import streamlit as st
-import plotly.express as px
 import pandas as pd
 import sys
 import os
 
-# Ensure the data_store module can be imported
+# Ensure the data_store, charts and widgets modules can be imported
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
 import data_store as ds
+import charts
+import widgets
+
+def value_chart(df_daily, df_monthly, metric, daily_window=None):
+    """
+    Build the chart of a metric over time, with a daily and a monthly trace when given.
+    """
+    traces = []
+    if df_daily is not None:
+        traces += charts.frame_traces(df_daily, 'Date', metric, name=f"Daily {metric.removeprefix('FB_')}")
+    if df_monthly is not None:
+        traces += charts.frame_traces(df_monthly, 'YearMonth', metric, name=f"Monthly {metric.removeprefix('FB_')}")
+    fig = charts.line_chart(f"{metric.removeprefix('FB_')} Over Time", traces)
+    if daily_window:
+        fig.update_xaxes(range=list(daily_window))
+    return fig
 
 st.set_page_config(layout="wide")
 st.title("Transaction Analysis")
@@ -16,207 +31,125 @@ if st.button("Clear Cache"):
     ds.clear_cache()
     st.success("Cache cleared successfully!")
 
+# Add a "Refresh Data" button that loads only transactions changed since the last load
+if st.button("Refresh Data"):
+    changed = ds.refresh_dataset("book_trans_enriched")
+    if changed is None:
+        st.error("Failed to refresh data.")
+    else:
+        st.success(f"Loaded {changed:,} new or changed transactions.")
+
 sel = "Transaction Value Analysis Over Time"
 st.markdown(f"**{sel}**")
-value_chart_tab, value_dataframe_tab = st.tabs(["Chart", "Tabular Data"])
+# Only the selected tab is computed, so switching tabs reruns the page
+value_chart_tab, value_dataframe_tab = widgets.lazy_tabs(["Chart", "Tabular Data"], "value_tabs")
 summary_tab = st.sidebar.expander("Data Summary")
 
-# SQL query to retrieve data
-query = """
-    SELECT 
-    fb.BOOK_TRANS_WID as FB_BOOK_TRANS_WID,
-    fb.BOOK_TRANS_ID as FB_BOOK_TRANS_ID,
-    fb.VISIT_ID as FB_VISIT_ID,
-    fb.CORPORATE_ENTITY_ID as FB_CORPORATE_ENTITY_ID,
-    fb.MANAGEMENT_ENTITY_ID as FB_MANAGEMENT_ENTITY_ID,
-    fb.VENUE_ID as FB_VENUE_ID,
-    fb.SOURCE_SYSTEMS as FB_SOURCE_SYSTEMS,
-    fb.SERVICE_ID as FB_SERVICE_ID,
-    fb.CREATESERVICETSTAMP as FB_CREATESERVICETSTAMP,
-    fb.MODSERVICETSTAMP as FB_MODSERVICETSTAMP,
-    fb.SERVICE_DATE as FB_SERVICE_DATE,
-    fb.TRANSTIXREF as FB_TRANSTIXREF,
-    fb.BILLED_NAME as FB_BILLED_NAME,
-    fb.CART_ID as FB_CART_ID,
-    fb.CHARGE_AMOUNT as FB_CHARGE_AMOUNT,
-    fb.CITY as FB_CITY,
-    fb.COUNTRY_CODE as FB_COUNTRY_CODE,
-    fb.EMAIL as FB_EMAIL,
-    fb.EVENT_ID as FB_EVENT_ID,
-    fb.GLOBALTYPE_DESC as FB_GLOBALTYPE_DESC,
-    fb.ITEM_NAME as FB_ITEM_NAME,
-    fb.MASTERITEM_ID as FB_MASTERITEM_ID,
-    fb.PARTY_ID as FB_PARTY_ID, 
-    fb.PAYACTION_DESC as FB_PAYACTION_DESC,
-    fb.PAYTYPE_DESC as FB_PAYTYPE_DESC,
-    fb.PLANNED_GUEST_COUNT as FB_PLANNED_GUEST_COUNT,
-    fb.PRESALE_TRANS_ID as FB_PRESALE_TRANS_ID,
-    fb.PROVINCE_CODE as FB_PROVINCE_CODE,
-    fb.SPENDAGREE_AMOUNT as FB_SPENDAGREE_AMOUNT,
-    fb.SUBTOTAL_AMOUNT as FB_SUBTOTAL_AMOUNT,
-    fb.TIXID as FB_TIXID,
-    fb.TRANSTIXID as FB_TRANSTIXID,
-    fb.ZIP as FB_ZIP,
-    
-    vs.VISIT_WID as VS_VISIT_WID,
-    vs.CURRENTSTATE_DESC as VS_CURRENTSTATE_DESC,
-    vs.COMPAGREE_AMOUNT as VS_COMPAGREE_AMOUNT,
-    vs.ORIGINATOR_ID as VS_ORIGINATOR_ID,
-    vs.OWNER_ID as VS_OWNER_ID,
-    vs.SPENDAGREE_AMOUNT as VS_SPENDAGREE_AMOUNT,
-    vs.SOURCE_CODE as VS_SOURCE_CODE,
-    vs.CANCELSTATE_DESC as VS_CANCELSTATE_DESC,
-    vs.SOURCE_LOC as VS_SOURCE_LOC,
-
-    vn.VENUE_RECORD_STATUS as VN_VENUE_RECORD_STATUS,
-    vn.CORPORATE_ENTITY_NAME as VN_CORPORATE_ENTITY_NAME,
-    vn.MANAGEMENT_ENTITY_NAME as VN_MANAGEMENT_ENTITY_NAME,
-    vn.VENUE_NAME as VN_VENUE_NAME,
-    vn.VENUE_MARKET_AREA_NAME as VN_VENUE_MARKET_AREA_NAME,
-    vn.VENUE_TYPE_NAME as VN_VENUE_TYPE_NAME,
-    vn.VENUE_CITY as VN_VENUE_CITY,
-    vn.VENUE_PROVINCE as VN_VENUE_PROVINCE,
-    vn.VENUE_COUNTRY as VN_VENUE_COUNTRY,
-
-    it.ITEM_ID as IT_ITEM_ID,
-    it.ITEM_GLOBALTYPE_CODE as IT_ITEM_GLOBALTYPE_CODE,
-    it.ITEM_PREFAB as IT_ITEM_PREFAB,
-    it.ITEM_PRICINGS as IT_ITEM_PRICINGS,
-    it.ITEM_PUBLICNAME as IT_ITEM_PUBLICNAME,
-    it.ITEM_BOOKTYPE_NAME as IT_ITEM_BOOKTYPE_NAME,
-    it.ITEM_TYPE_CODE_NAME as IT_ITEM_TYPE_CODE_NAME
-
-    FROM edw.public.fact_book_trans fb
-    LEFT JOIN edw.public.dim_visit vs on fb.visit_id = vs.visit_id
-    LEFT JOIN edw.public.dim_venue vn on vs.venue_id = vn.venue_id
-    LEFT JOIN edw.public.dim_item it on fb.masteritem_id = it.item_id
-    WHERE fb.source_systems IN ('PAY', 'urcheckout')
-"""
-
-# Load data using the data_store function
-df = ds.get_dataframe(query)
+st.sidebar.header("Filters")
 
-if df is not None:
-    st.sidebar.header("Filters")
-    
-    # Load saved filters from data_store
-    filters = ds.get_filters()
-    
-    # Date Range Filter
-    filter_type = st.sidebar.radio("Select Date Filter Type", ("Transaction Date", "Event Date"))
-    filters["date_column"] = "FB_CREATESERVICETSTAMP" if filter_type == "Transaction Date" else "FB_SERVICE_DATE"
-    
-    date_filter = st.sidebar.date_input("Select Date Range", filters.get("date_range", []))
-    if len(date_filter) == 2:
-        filters["date_range"] = date_filter
+# Load saved filters from data_store
+filters = ds.get_filters()
+
+# Date Range Filter
+filter_type = st.sidebar.radio("Select Date Filter Type", ("Transaction Date", "Event Date"))
+filters["date_column"] = "FB_CREATESERVICETSTAMP" if filter_type == "Transaction Date" else "FB_SERVICE_DATE"
+
+date_filter = st.sidebar.date_input("Select Date Range", filters.get("date_range", []))
+if len(date_filter) == 2:
+    filters["date_range"] = date_filter
 
-    # Apply initial filters to the DataFrame for cascading effect
-    df_filtered = ds.filter_data(df, {"date_range": filters.get("date_range"), "date_column": filters["date_column"]})
+# Load the shared dataset, sliced to the date range
+df = ds.get_dataset("book_trans_enriched", {"date_range": filters.get("date_range"), "date_column": filters["date_column"]})
+
+if df is not None:
+    # Report how the data was loaded
+    summary_tab.markdown(ds.load_summary(df))
 
     # Cascading Filters
-    corporate_filter = st.sidebar.multiselect("Select Corporate Entity", df_filtered["VN_CORPORATE_ENTITY_NAME"].unique(), default=filters.get("corporate_entity", []))
-    if corporate_filter:
-        filters["corporate_entity"] = corporate_filter
-        df_filtered = df_filtered[df_filtered["VN_CORPORATE_ENTITY_NAME"].isin(corporate_filter)]
+    corporate_entity_options = ds.cascade_options(df, filters, "corporate_entity")
+    corporate_filter = st.sidebar.multiselect("Select Corporate Entity", corporate_entity_options, format_func=ds.option_label(corporate_entity_options), default=filters.get("corporate_entity", []))
+    filters["corporate_entity"] = corporate_filter
     
-    management_filter = st.sidebar.multiselect("Select Management Entity", df_filtered["VN_MANAGEMENT_ENTITY_NAME"].unique(), default=filters.get("management_entity", []))
-    if management_filter:
-        filters["management_entity"] = management_filter
-        df_filtered = df_filtered[df_filtered["VN_MANAGEMENT_ENTITY_NAME"].isin(management_filter)]
+    management_entity_options = ds.cascade_options(df, filters, "management_entity")
+    management_filter = st.sidebar.multiselect("Select Management Entity", management_entity_options, format_func=ds.option_label(management_entity_options), default=filters.get("management_entity", []))
+    filters["management_entity"] = management_filter
     
     # Separate Dropdowns for Venue Type, Global Type, and Pay Type
-    venue_type_filter = st.sidebar.multiselect("Select Venue Type", df_filtered["VN_VENUE_TYPE_NAME"].unique(), default=filters.get("venue_type", []))
-    if venue_type_filter:
-        filters["venue_type"] = venue_type_filter
-        df_filtered = df_filtered[df_filtered["VN_VENUE_TYPE_NAME"].isin(venue_type_filter)]
-
-    global_type_filter = st.sidebar.multiselect("Select Global Type", df_filtered["FB_GLOBALTYPE_DESC"].unique(), default=filters.get("global_type", []))
-    if global_type_filter:
-        filters["global_type"] = global_type_filter
-        df_filtered = df_filtered[df_filtered["FB_GLOBALTYPE_DESC"].isin(global_type_filter)]
-
-    pay_type_filter = st.sidebar.multiselect("Select Pay Type", df_filtered["FB_PAYTYPE_DESC"].unique(), default=filters.get("pay_type", []))
-    if pay_type_filter:
-        filters["pay_type"] = pay_type_filter
-        df_filtered = df_filtered[df_filtered["FB_PAYTYPE_DESC"].isin(pay_type_filter)]
+    venue_type_options = ds.cascade_options(df, filters, "venue_type")
+    venue_type_filter = st.sidebar.multiselect("Select Venue Type", venue_type_options, format_func=ds.option_label(venue_type_options), default=filters.get("venue_type", []))
+    filters["venue_type"] = venue_type_filter
+
+    global_type_options = ds.cascade_options(df, filters, "global_type")
+    global_type_filter = st.sidebar.multiselect("Select Global Type", global_type_options, format_func=ds.option_label(global_type_options), default=filters.get("global_type", []))
+    filters["global_type"] = global_type_filter
+
+    pay_type_options = ds.cascade_options(df, filters, "pay_type")
+    pay_type_filter = st.sidebar.multiselect("Select Pay Type", pay_type_options, format_func=ds.option_label(pay_type_options), default=filters.get("pay_type", []))
+    filters["pay_type"] = pay_type_filter
     
-    venue_filter = st.sidebar.multiselect("Select Venue", df_filtered["VN_VENUE_NAME"].unique(), default=filters.get("venue", []))
-    if venue_filter:
-        filters["venue"] = venue_filter
-        df_filtered = df_filtered[df_filtered["VN_VENUE_NAME"].isin(venue_filter)]
+    venue_options = ds.cascade_options(df, filters, "venue")
+    venue_filter = st.sidebar.multiselect("Select Venue", venue_options, format_func=ds.option_label(venue_options), default=filters.get("venue", []))
+    filters["venue"] = venue_filter
     
-    pay_status_filter = st.sidebar.multiselect("Select Pay Status", df_filtered["FB_PAYACTION_DESC"].unique(), default=filters.get("pay_status", []))
-    if pay_status_filter:
-        filters["pay_status"] = pay_status_filter
-        df_filtered = df_filtered[df_filtered["FB_PAYACTION_DESC"].isin(pay_status_filter)]
+    pay_status_options = ds.cascade_options(df, filters, "pay_status")
+    pay_status_filter = st.sidebar.multiselect("Select Pay Status", pay_status_options, format_func=ds.option_label(pay_status_options), default=filters.get("pay_status", []))
+    filters["pay_status"] = pay_status_filter
     
     # Save updated filters back to data_store
     ds.save_filters(filters)
 
     # Final data check and visualization
-    if df_filtered.empty:
+    if ds.cascade_count(df, filters) == 0:
         st.error("No data available with the current filters. Please select different filters.")
     else:
-        # Ensure the dates are properly aggregated by day and month
-        df_filtered['Date'] = df_filtered['FB_CREATESERVICETSTAMP'].dt.date
-        df_filtered['YearMonth'] = df_filtered['FB_CREATESERVICETSTAMP'].dt.to_period('M').astype(str)
-        
-        # Group by Date and Month
-        df_grouped_day = df_filtered.groupby('Date').agg({
-            'FB_CHARGE_AMOUNT': 'sum',
-            'FB_SPENDAGREE_AMOUNT': 'sum',
-            'FB_SUBTOTAL_AMOUNT': 'sum',
-            'FB_PLANNED_GUEST_COUNT': 'sum'
-        }).reset_index()
-        
-        df_grouped_month = df_filtered.groupby('YearMonth').agg({
-            'FB_CHARGE_AMOUNT': 'sum',
-            'FB_SPENDAGREE_AMOUNT': 'sum',
-            'FB_SUBTOTAL_AMOUNT': 'sum',
-            'FB_PLANNED_GUEST_COUNT': 'sum'
-        }).reset_index()
-
         # User selection for daily, monthly, or both views
         view_type = st.sidebar.radio("Select View Type", ["Daily", "Monthly", "Both"], index=2)
+        show_daily, show_monthly = view_type in ["Daily", "Both"], view_type in ["Monthly", "Both"]
+
+        # Aggregate by day and month under the selected filters, only for the views shown
+        grouped_day = widgets.deferred(ds.get_aggregate, ds.METRIC_COLUMNS, "day", filters, df)
+        grouped_month = widgets.deferred(ds.get_aggregate, ds.METRIC_COLUMNS, "month", filters, df)
+        if (show_daily and grouped_day() is None) or (show_monthly and grouped_month() is None):
+            st.stop()
         
-        # Initialize the charts
-        fig1 = px.line(title="CHARGE_AMOUNT Over Time")
-        fig2 = px.line(title="SPENDAGREE_AMOUNT Over Time")
-        fig3 = px.line(title="SUBTOTAL_AMOUNT Over Time")
-        fig4 = px.line(title="PLANNED_GUEST_COUNT Over Time")
-
-        if view_type in ["Daily", "Both"]:
-            fig1.add_scatter(x=df_grouped_day['Date'], y=df_grouped_day['FB_CHARGE_AMOUNT'], mode='lines', name='Daily CHARGE_AMOUNT')
-            fig2.add_scatter(x=df_grouped_day['Date'], y=df_grouped_day['FB_SPENDAGREE_AMOUNT'], mode='lines', name='Daily SPENDAGREE_AMOUNT')
-            fig3.add_scatter(x=df_grouped_day['Date'], y=df_grouped_day['FB_SUBTOTAL_AMOUNT'], mode='lines', name='Daily SUBTOTAL_AMOUNT')
-            fig4.add_scatter(x=df_grouped_day['Date'], y=df_grouped_day['FB_PLANNED_GUEST_COUNT'], mode='lines', name='Daily PLANNED_GUEST_COUNT')
-            
-        if view_type in ["Monthly", "Both"]:
-            fig1.add_scatter(x=df_grouped_month['YearMonth'].astype(str), y=df_grouped_month['FB_CHARGE_AMOUNT'], mode='lines', name='Monthly CHARGE_AMOUNT')
-            fig2.add_scatter(x=df_grouped_month['YearMonth'].astype(str), y=df_grouped_month['FB_SPENDAGREE_AMOUNT'], mode='lines', name='Monthly SPENDAGREE_AMOUNT')
-            fig3.add_scatter(x=df_grouped_month['YearMonth'].astype(str), y=df_grouped_month['FB_SUBTOTAL_AMOUNT'], mode='lines', name='Monthly SUBTOTAL_AMOUNT')
-            fig4.add_scatter(x=df_grouped_month['YearMonth'].astype(str), y=df_grouped_month['FB_PLANNED_GUEST_COUNT'], mode='lines', name='Monthly PLANNED_GUEST_COUNT')
-
-        # Display charts in the tab
-        with value_chart_tab:
-            st.plotly_chart(fig1, use_container_width=True)
-            st.plotly_chart(fig2, use_container_width=True)
-            st.plotly_chart(fig3, use_container_width=True)
-            st.plotly_chart(fig4, use_container_width=True)
+        # Daily traces are downsampled to the chart width; narrowing the window shows every day in it
+        daily_window = None
+        if show_daily and len(grouped_day()) > charts.CHART_WIDTH:
+            first_day, last_day = grouped_day()['Date'].iloc[0], grouped_day()['Date'].iloc[-1]
+            daily_window = st.sidebar.slider("Daily Chart Window", min_value=first_day, max_value=last_day, value=(first_day, last_day))
+
+        if widgets.tab_open(value_chart_tab):
+            # Build the charts, reusing those built before from the same data and options
+            figs = [
+                charts.cached_figure(value_chart,
+                                 charts.downsample(grouped_day(), 'Date', metric, window=daily_window) if show_daily else None,
+                                 grouped_month() if show_monthly else None,
+                                 metric=metric, daily_window=daily_window)
+                for metric in ds.METRIC_COLUMNS
+            ]
+
+            # Display charts in the tab
+            with value_chart_tab:
+                for fig in figs:
+                    st.plotly_chart(fig, use_container_width=True)
+
+            # Report the chart building saved by reuse
+            summary_tab.markdown(charts.figure_summary())
         
         # Display data frame in the tab based on selected view type
-        with value_dataframe_tab:
-            if view_type == "Daily":
-                st.write("Transaction Value Data - Daily View")
-                st.dataframe(df_grouped_day, height=400, width=1000)
-            elif view_type == "Monthly":
-                st.write("Transaction Value Data - Monthly View")
-                st.dataframe(df_grouped_month, height=400, width=1000)
-            elif view_type == "Both":
-                st.write("Transaction Value Data - Daily and Monthly View")
-                st.write("Daily Data")
-                st.dataframe(df_grouped_day, height=200, width=1000)
-                st.write("Monthly Data")
-                st.dataframe(df_grouped_month, height=200, width=1000)
+        if widgets.tab_open(value_dataframe_tab):
+            with value_dataframe_tab:
+                if view_type == "Daily":
+                    st.write("Transaction Value Data - Daily View")
+                    widgets.paged_table(grouped_day(), "daily", height=400, width=1000)
+                elif view_type == "Monthly":
+                    st.write("Transaction Value Data - Monthly View")
+                    widgets.paged_table(grouped_month(), "monthly", height=400, width=1000)
+                elif view_type == "Both":
+                    st.write("Transaction Value Data - Daily and Monthly View")
+                    st.write("Daily Data")
+                    widgets.paged_table(grouped_day(), "daily", height=200, width=1000)
+                    st.write("Monthly Data")
+                    widgets.paged_table(grouped_month(), "monthly", height=200, width=1000)
 else:
     st.error("Failed to retrieve data.")
\ No newline at end of file
@@ -1,153 +1,52 @@
 import streamlit as st
-from snowflake.snowpark import Session
 import plotly.express as px
-import pandas as pd
-import os, configparser
-from snowflake.snowpark.context import get_active_session
+import sys
+import os
+
+# Ensure the data_store and widgets modules can be imported
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+import data_store as ds
+import widgets
 
 st.set_page_config(layout="wide")
 st.title("Seasonal Transaction Trend Analysis")
 
 # Add a "Clear Cache" button at the top
 if st.button("Clear Cache"):
-    st.cache_data.clear()
-    st.cache_resource.clear()
+    ds.clear_cache()
     st.success("Cache cleared successfully!")
 
+# Add a "Refresh Data" button that loads only transactions changed since the last load
+if st.button("Refresh Data"):
+    changed = ds.refresh_dataset("book_trans_enriched")
+    if changed is None:
+        st.error("Failed to refresh data.")
+    else:
+        st.success(f"Loaded {changed:,} new or changed transactions.")
+
 sel = "Seasonal Transaction Analysis Over Time"
 st.markdown(f"**{sel}**")
-seasonal_chart_tab, seasonal_dataframe_tab = st.tabs(["Chart", "Tabular Data"])
+# Only the selected tab is computed, so switching tabs reruns the page
+seasonal_chart_tab, seasonal_dataframe_tab = widgets.lazy_tabs(["Chart", "Tabular Data"], "seasonal_tabs")
 summary_tab = st.sidebar.expander("Data Summary")
 
-@st.cache_resource
-def get_session():
-    try:
-        return get_active_session()
-    except:
-        parser = configparser.ConfigParser()
-        parser.read(os.path.join(os.path.expanduser('~'), ".snowsql/config"))
-        section = "connections.demo_conn"
-        pars = {
-            "account": parser.get(section, "account"),
-            "user": parser.get(section, "username"),
-            "password": parser.get(section, "password"),
-            "warehouse": parser.get(section, "warehousename"),
-            "role": parser.get(section, "role"),
-            "client_session_keep_alive": True
-        }
-        return Session.builder.configs(pars).create()
-
-@st.cache_data
-def get_dataframe(query):
-    session = get_session()
-    if session is None:
-        st.error("Session is not initialized.")
-        return None
-    try:
-        snow_df = session.sql(query).to_pandas()
-        snow_df = snow_df.drop_duplicates()
-
-        # Convert relevant columns to datetime with error handling
-        snow_df['FB_CREATESERVICETSTAMP'] = pd.to_datetime(snow_df['FB_CREATESERVICETSTAMP'], unit='s', errors='coerce')
-        snow_df['FB_SERVICE_DATE'] = pd.to_datetime(snow_df['FB_SERVICE_DATE'], format='%m/%d/%Y', errors='coerce')
-        
-        # Handle missing or erroneous dates by dropping or setting a default date
-        snow_df.dropna(subset=['FB_CREATESERVICETSTAMP', 'FB_SERVICE_DATE'], inplace=True)
-        
-        return snow_df
-    except Exception as e:
-        st.error(f"Failed to execute query or process data: {str(e)}")
-        return None
-
-query = """
-    SELECT 
-    fb.BOOK_TRANS_WID as FB_BOOK_TRANS_WID,
-    fb.BOOK_TRANS_ID as FB_BOOK_TRANS_ID,
-    fb.VISIT_ID as FB_VISIT_ID,
-    fb.CORPORATE_ENTITY_ID as FB_CORPORATE_ENTITY_ID,
-    fb.MANAGEMENT_ENTITY_ID as FB_MANAGEMENT_ENTITY_ID,
-    fb.VENUE_ID as FB_VENUE_ID,
-    fb.SOURCE_SYSTEMS as FB_SOURCE_SYSTEMS,
-    fb.SERVICE_ID as FB_SERVICE_ID,
-    fb.CREATESERVICETSTAMP as FB_CREATESERVICETSTAMP,
-    fb.MODSERVICETSTAMP as FB_MODSERVICETSTAMP,
-    fb.SERVICE_DATE as FB_SERVICE_DATE,
-    fb.TRANSTIXREF as FB_TRANSTIXREF,
-    fb.BILLED_NAME as FB_BILLED_NAME,
-    fb.CART_ID as FB_CART_ID,
-    fb.CHARGE_AMOUNT as FB_CHARGE_AMOUNT,
-    fb.CITY as FB_CITY,
-    fb.COUNTRY_CODE as FB_COUNTRY_CODE,
-    fb.EMAIL as FB_EMAIL,
-    fb.EVENT_ID as FB_EVENT_ID,
-    fb.GLOBALTYPE_DESC as FB_GLOBALTYPE_DESC,
-    fb.ITEM_NAME as FB_ITEM_NAME,
-    fb.MASTERITEM_ID as FB_MASTERITEM_ID,
-    fb.PARTY_ID as FB_PARTY_ID, 
-    fb.PAYACTION_DESC as FB_PAYACTION_DESC,
-    fb.PAYTYPE_DESC as FB_PAYTYPE_DESC,
-    fb.PLANNED_GUEST_COUNT as FB_PLANNED_GUEST_COUNT,
-    fb.PRESALE_TRANS_ID as FB_PRESALE_TRANS_ID,
-    fb.PROVINCE_CODE as FB_PROVINCE_CODE,
-    fb.SPENDAGREE_AMOUNT as FB_SPENDAGREE_AMOUNT,
-    fb.SUBTOTAL_AMOUNT as FB_SUBTOTAL_AMOUNT,
-    fb.TIXID as FB_TIXID,
-    fb.TRANSTIXID as FB_TRANSTIXID,
-    fb.ZIP as FB_ZIP,
-    
-    vs.VISIT_WID as VS_VISIT_WID,
-    vs.CURRENTSTATE_DESC as VS_CURRENTSTATE_DESC,
-    vs.COMPAGREE_AMOUNT as VS_COMPAGREE_AMOUNT,
-    vs.ORIGINATOR_ID as VS_ORIGINATOR_ID,
-    vs.OWNER_ID as VS_OWNER_ID,
-    vs.SPENDAGREE_AMOUNT as VS_SPENDAGREE_AMOUNT,
-    vs.SOURCE_CODE as VS_SOURCE_CODE,
-    vs.CANCELSTATE_DESC as VS_CANCELSTATE_DESC,
-    vs.SOURCE_LOC as VS_SOURCE_LOC,
-
-    vn.VENUE_RECORD_STATUS as VN_VENUE_RECORD_STATUS,
-    vn.CORPORATE_ENTITY_NAME as VN_CORPORATE_ENTITY_NAME,
-    vn.MANAGEMENT_ENTITY_NAME as VN_MANAGEMENT_ENTITY_NAME,
-    vn.VENUE_NAME as VN_VENUE_NAME,
-    vn.VENUE_MARKET_AREA_NAME as VN_VENUE_MARKET_AREA_NAME,
-    vn.VENUE_TYPE_NAME as VN_VENUE_TYPE_NAME,
-    vn.VENUE_CITY as VN_VENUE_CITY,
-    vn.VENUE_PROVINCE as VN_VENUE_PROVINCE,
-    vn.VENUE_COUNTRY as VN_VENUE_COUNTRY,
-
-    it.ITEM_ID as IT_ITEM_ID,
-    it.ITEM_GLOBALTYPE_CODE as IT_ITEM_GLOBALTYPE_CODE,
-    it.ITEM_PREFAB as IT_ITEM_PREFAB,
-    it.ITEM_PRICINGS as IT_ITEM_PRICINGS,
-    it.ITEM_PUBLICNAME as IT_ITEM_PUBLICNAME,
-    it.ITEM_BOOKTYPE_NAME as IT_ITEM_BOOKTYPE_NAME,
-    it.ITEM_TYPE_CODE_NAME as IT_ITEM_TYPE_CODE_NAME
-
-    FROM edw.public.fact_book_trans fb
-    LEFT JOIN edw.public.dim_visit vs on fb.visit_id = vs.visit_id
-    LEFT JOIN edw.public.dim_venue vn on vs.venue_id = vn.venue_id
-    LEFT JOIN edw.public.dim_item it on fb.masteritem_id = it.item_id
-    WHERE fb.source_systems IN ('PAY', 'urcheckout')
-"""
-
-df = get_dataframe(query)
+# Load the shared dataset from data_store
+df = ds.get_dataset("book_trans_enriched")
 
 if df is not None:
     st.sidebar.header("Filters")
     
     # Date Range Filter
     filter_type = st.sidebar.radio("Select Date Filter Type", ("Transaction Date", "Event Date"))
-    df_filtered = df.copy()
+    df_filtered = df
     if filter_type == "Transaction Date":
         date_filter = st.sidebar.date_input("Select Transaction Date Range", [])
         if len(date_filter) == 2:
-            df_filtered = df_filtered[(df_filtered['FB_CREATESERVICETSTAMP'] >= pd.Timestamp(date_filter[0])) & 
-                                       (df_filtered['FB_CREATESERVICETSTAMP'] <= pd.Timestamp(date_filter[1]))]
+            df_filtered = ds.filter_data(df, {"date_range": date_filter, "date_column": "FB_CREATESERVICETSTAMP"})
     else:
         date_filter = st.sidebar.date_input("Select Event Date Range", [])
         if len(date_filter) == 2:
-            df_filtered = df_filtered[(df_filtered['FB_SERVICE_DATE'] >= pd.Timestamp(date_filter[0])) & 
-                                       (df_filtered['FB_SERVICE_DATE'] <= pd.Timestamp(date_filter[1]))]
+            df_filtered = ds.filter_data(df, {"date_range": date_filter, "date_column": "FB_SERVICE_DATE"})
 
     # Ensure at least one non-date filter is selected
     filters_selected = False
@@ -194,57 +93,51 @@ if df is not None:
     if df_filtered.empty:
         st.error("No data available with the current filters. Please select different filters.")
     else:
+        # Work on a copy, as the filtered rows may be shared with the cache
+        df_filtered = df_filtered.copy()
+
         # Define seasons based on month
-        df_filtered['Month'] = df_filtered['FB_CREATESERVICETSTAMP'].dt.month
-        df_filtered['Season'] = df_filtered['Month'].apply(lambda x: 
-                                                          'Winter' if x in [12, 1, 2] else 
-                                                          'Spring' if x in [3, 4, 5] else 
-                                                          'Summer' if x in [6, 7, 8] else 
-                                                          'Fall')
-        df_filtered['Year'] = df_filtered['FB_CREATESERVICETSTAMP'].dt.year
-        df_filtered['YearSeason'] = df_filtered['Year'].astype(str) + " " + df_filtered['Season']
+        df_filtered['YearSeason'] = ds.time_buckets(df, 'FB_CREATESERVICETSTAMP', 'season')
         
-        # Group by YearSeason
-        df_grouped_season = df_filtered.groupby(['YearSeason']).agg({
+        # Group by YearSeason, in season order
+        df_grouped_season = df_filtered.groupby(['YearSeason'], observed=True).agg({
             'FB_CHARGE_AMOUNT': 'sum',
             'FB_SPENDAGREE_AMOUNT': 'sum',
             'FB_SUBTOTAL_AMOUNT': 'sum',
             'FB_PLANNED_GUEST_COUNT': 'sum'
         }).reset_index()
         
-        # Sort by YearSeason
-        df_grouped_season['YearSeason'] = pd.Categorical(df_grouped_season['YearSeason'], ordered=True)
-        df_grouped_season = df_grouped_season.sort_values('YearSeason')
-        
-        # Create separate charts for each metric
-        fig_charge_amount = px.line(df_grouped_season, x='YearSeason', y='FB_CHARGE_AMOUNT',
-                                    title="CHARGE_AMOUNT by Season Over Time", markers=True)
+        if widgets.tab_open(seasonal_chart_tab):
+            # Create separate charts for each metric
+            fig_charge_amount = px.line(df_grouped_season, x='YearSeason', y='FB_CHARGE_AMOUNT',
+                                        title="CHARGE_AMOUNT by Season Over Time", markers=True)
         
-        fig_spendagree_amount = px.line(df_grouped_season, x='YearSeason', y='FB_SPENDAGREE_AMOUNT',
-                                        title="SPENDAGREE_AMOUNT by Season Over Time", markers=True)
+            fig_spendagree_amount = px.line(df_grouped_season, x='YearSeason', y='FB_SPENDAGREE_AMOUNT',
+                                            title="SPENDAGREE_AMOUNT by Season Over Time", markers=True)
         
-        fig_subtotal_amount = px.line(df_grouped_season, x='YearSeason', y='FB_SUBTOTAL_AMOUNT',
-                                      title="SUBTOTAL_AMOUNT by Season Over Time", markers=True)
+            fig_subtotal_amount = px.line(df_grouped_season, x='YearSeason', y='FB_SUBTOTAL_AMOUNT',
+                                          title="SUBTOTAL_AMOUNT by Season Over Time", markers=True)
         
-        fig_planned_guest_count = px.line(df_grouped_season, x='YearSeason', y='FB_PLANNED_GUEST_COUNT',
-                                          title="PLANNED_GUEST_COUNT by Season Over Time", markers=True)
+            fig_planned_guest_count = px.line(df_grouped_season, x='YearSeason', y='FB_PLANNED_GUEST_COUNT',
+                                              title="PLANNED_GUEST_COUNT by Season Over Time", markers=True)
         
-        # Adjusting x-axis labels rotation for clarity
-        for fig in [fig_charge_amount, fig_spendagree_amount, fig_subtotal_amount, fig_planned_guest_count]:
-            fig.update_xaxes(tickangle=-45, title_text="Season", tickmode="linear")
-            fig.update_yaxes(title_text="Transaction Value")
-            fig.update_layout(margin=dict(l=20, r=20, t=50, b=100))
+            # Adjusting x-axis labels rotation for clarity
+            for fig in [fig_charge_amount, fig_spendagree_amount, fig_subtotal_amount, fig_planned_guest_count]:
+                fig.update_xaxes(tickangle=-45, title_text="Season", tickmode="linear")
+                fig.update_yaxes(title_text="Transaction Value")
+                fig.update_layout(margin=dict(l=20, r=20, t=50, b=100))
         
-        # Display charts in the tab
-        with seasonal_chart_tab:
-            st.plotly_chart(fig_charge_amount, use_container_width=True)
-            st.plotly_chart(fig_spendagree_amount, use_container_width=True)
-            st.plotly_chart(fig_subtotal_amount, use_container_width=True)
-            st.plotly_chart(fig_planned_guest_count, use_container_width=True)
+            # Display charts in the tab
+            with seasonal_chart_tab:
+                st.plotly_chart(fig_charge_amount, use_container_width=True)
+                st.plotly_chart(fig_spendagree_amount, use_container_width=True)
+                st.plotly_chart(fig_subtotal_amount, use_container_width=True)
+                st.plotly_chart(fig_planned_guest_count, use_container_width=True)
         
         # Display data frame in the tab
-        with seasonal_dataframe_tab:
-            st.write("Transaction Data by Season Over Time")
-            st.dataframe(df_grouped_season, height=400, width=1000)
+        if widgets.tab_open(seasonal_dataframe_tab):
+            with seasonal_dataframe_tab:
+                st.write("Transaction Data by Season Over Time")
+                widgets.paged_table(df_grouped_season, "season", height=400, width=1000)
 else:
     st.error("Failed to retrieve data.")
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Streamlit widgets the pages share: server-side paged tables, and tabs that only
+compute the views they show.
+"""
+import inspect
+import numpy as np
+import streamlit as st
+import data_store as ds
+
+# Rows per page of the tables shown with paged_table.
+TABLE_PAGE_ROWS = 100
+
+@ds.bounded_cache(ttl=None, key=lambda df, column, descending: (column, descending),
+               frame=lambda df, column, descending: df)
+def sort_order(df, column, descending):
+    """
+    Return the row positions of a dataframe in the order of one of its columns, with
+    missing values last. The order is computed once per frame, column and direction,
+    so paging through a sorted table only slices it. The rollups the pages show are
+    the same cached frames on every rerun, so their order is reused across reruns.
+    :param df: Dataframe to sort
+    :param column: Name of the column to sort by
+    :param descending: Whether to sort from the largest value down
+    :return: Array of row positions
+    """
+    values = df[column].reset_index(drop=True)
+    return values.sort_values(ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+
+def paged_table(df, key, height=400, width=1000):
+    """
+    Show a dataframe one page of TABLE_PAGE_ROWS rows at a time, sorted on the server
+    by a column the user picks. Only the rows of the current page are sent to the
+    browser, so the table costs the same to show whatever the size of the dataframe.
+    :param df: Dataframe to show
+    :param key: Key prefix of the table's widgets, unique within the page
+    :param height: Height of the table in pixels
+    :param width: Width of the table in pixels
+    """
+    pages = max(1, -(-len(df) // TABLE_PAGE_ROWS))
+    # Go back to the first page when the data no longer reaches the selected one
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    sort_column, direction_column, page_column = st.columns(3)
+    column = sort_column.selectbox("Sort by", ["(none)"] + list(df.columns), key=f"{key}_sort")
+    direction = direction_column.selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order")
+    page = page_column.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    start = (page - 1) * TABLE_PAGE_ROWS
+    if column == "(none)":
+        rows = np.arange(start, min(start + TABLE_PAGE_ROWS, len(df)))
+    else:
+        rows = sort_order(df, column, direction == "Descending")[start:start + TABLE_PAGE_ROWS]
+    if len(rows):
+        st.caption(f"Rows {start + 1:,} to {start + len(rows):,} of {len(df):,}")
+    st.dataframe(df.iloc[rows], height=height, width=width)
+
+def deferred(func, *args, **kwargs):
+    """
+    Defer func(*args, **kwargs) until the returned function is first called, and return
+    that result from every later call. A page builds its views from deferred steps so
+    only the steps of the views it shows run; across reruns, the caches behind the steps
+    make switching back to a view instant.
+    """
+    results = []
+    def run():
+        if not results:
+            results.append(func(*args, **kwargs))
+        return results[0]
+    return run
+
+def lazy_tabs(labels, key):
+    """
+    Create tabs that track which one is selected, rerunning the page on a switch, so
+    tab_open can skip the hidden ones. Streamlit runtimes older than tab selection
+    tracking get plain tabs, which all count as shown.
+    :param labels: List of tab labels
+    :param key: Widget key of the tabs, unique within the page
+    :return: List of tab containers
+    """
+    if "on_change" in inspect.signature(st.tabs).parameters:
+        return st.tabs(labels, key=key, on_change="rerun")
+    return st.tabs(labels)
+
+def tab_open(tab):
+    """
+    Return whether the content of a tab is shown. Tabs created with on_change="rerun"
+    report whether they are selected; tabs that do not track selection always count
+    as shown.
+    """
+    return getattr(tab, "open", None) is not False